@@ -1,16 +1,36 @@
 # app.py
-from fastapi import FastAPI, Depends, HTTPException, status, Request, File, UploadFile # Adicionado File e UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+import time
+_import_started = time.perf_counter()  # Tempo de importação do módulo, exposto em /health/ready
+
+from fastapi import FastAPI, Depends, HTTPException, status, Request, File, UploadFile, Query, Header # Adicionado File e UploadFile
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Annotated
-import pandas as pd
+from pydantic import TypeAdapter
+from typing import List, Annotated, Literal
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import hmac
 import io
-
-import crud, models, schemas
-from database import SessionLocal, engine, Base
+import os
+
+import async_crud, crud, exports, models, pagination, schemas, stock_import
+from audit import audit_writer
+from cache import catalog_versions, response_cache, user_cache
+from coordination import coordinator
+from jobs import job_runner
+from log_archive import log_archiver
+from snapshots import snapshot_scheduler
+from stock_analytics import consumption_analytics
+from startup import ensure_schema, startup_report
+from stock_feed import stock_feed
+from compression import CompressionMiddleware
+from pages import FingerprintedStaticFiles, page_cache, static_assets
+from metrics import MetricsMiddleware, db_metrics, pool_stats, render_prometheus, route_metrics
+from login_guard import LoginOverloaded, LoginRateLimited, login_gate, login_rate_limiter
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
 from config import settings
 
 app = FastAPI(
@@ -20,9 +40,12 @@ app = FastAPI(
     root_path=settings.ROOT_PATH
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# A métrica envolve a compressão: o tempo medido inclui o custo de comprimir
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+app.add_middleware(MetricsMiddleware, route_metrics=route_metrics)
+app.mount("/static", FingerprintedStaticFiles(assets=static_assets), name="static")
 
-templates = Jinja2Templates(directory="templates")
+PAGES = ["login.html", "admin.html", "stock.html", "logs.html"]
 
 # --- NENHUMA MUDANÇA NAS FUNÇÕES ABAIXO ATÉ A SEÇÃO DE ESTOQUE ---
 
@@ -33,17 +56,176 @@ def get_db():
     finally:
         db.close()
 
+async def get_read_db():
+    """
+    Sessão das rotas de leitura: AsyncSession quando USE_ASYNC_DB está ativo,
+    senão a sessão síncrona de sempre (usada via run_db, fora do event loop).
+    """
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+    else:
+        async with AsyncSessionLocal() as db:
+            yield db
+
+async def run_db(db, sync_fn, async_fn, *args, **kwargs):
+    """Executa a consulta na variante assíncrona, ou na síncrona dentro do pool de threads."""
+    if AsyncSessionLocal is None:
+        return await run_in_threadpool(sync_fn, db, *args, **kwargs)
+    return await async_fn(db, *args, **kwargs)
+
+async def cached_listing(request: Request, catalog: str, model, query: tuple, load) -> Response:
+    """
+    Responde uma listagem a partir da versão atual do catálogo: 304 se o cliente já tem
+    essa versão (If-None-Match), senão o JSON guardado em response_cache, e só em último
+    caso consulta o banco com `load()`. A versão é lida antes da consulta, para que uma
+    alteração concorrente nunca fique guardada sob uma versão antiga.
+    """
+    version = catalog_versions.get(catalog)
+    digest = hashlib.sha1(repr((str(model), query)).encode()).hexdigest()[:16]
+    etag = f'W/"{catalog_versions.epoch}-{version}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = (catalog, version, str(model), query)
+    body = response_cache.get(key)
+    if body is None:
+        adapter = TypeAdapter(model)
+        body = adapter.dump_json(adapter.validate_python(await load(), from_attributes=True))
+        response_cache.set(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.on_event("startup")
 def on_startup():
-    Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
+    # Com vários workers, um de cada vez: o primeiro aplica o esquema e cria o administrador,
+    # os seguintes encontram tudo em dia (ver startup.py e coordination.py)
+    with coordinator.startup_lock():
+        # O esquema só é recriado quando mudou desde a última partida
+        with startup_report.phase("schema"):
+            startup_report.schema_applied = ensure_schema(engine)
+        with startup_report.phase("admin"):
+            db = SessionLocal()
+            try:
+                crud.create_admin_if_not_exists(db)
+            finally:
+                db.close()
+    # As páginas só dependem de ROOT_PATH: renderizadas (e comprimidas) uma única vez
+    with startup_report.phase("pages"):
+        static_assets.load()
+        page_cache.render_all(PAGES)
+    login_gate.start()
+    if settings.AUDIT_MODE == "batched":
+        audit_writer.start()
+    # Recebe as mudanças do estoque confirmadas nos outros workers (feed /stock/events)
+    coordinator.peers.start(stock_feed.receive)
+    # Cada worker mantém o próprio histórico de consumo em memória (GET /stock/analytics)
+    consumption_analytics.start_warm_up()
+    # Só o worker líder roda os serviços de segundo plano; /health/ready espera por eles
+    startup_report.run_in_background(("background_services", lambda: coordinator.elect(start_background_services)))
+
+def start_background_services():
+    """Serviços que rodam num único processo: o worker líder."""
+    # A primeira fotografia do estoque (se vencida) é gravada pela própria thread do agendador,
+    # que também remove periodicamente as Idempotency-Keys vencidas
+    snapshot_scheduler.start()
+    log_archiver.start()
+    # Retoma as tarefas em segundo plano que ficaram na fila ou foram interrompidas
+    job_runner.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Nenhum serviço de segundo plano pode estar começando enquanto os demais param
+    startup_report.stop_background()
+    coordinator.stop_following()
+    # Grava os logs que ainda estão na fila antes de encerrar
+    audit_writer.stop()
+    login_gate.shutdown()
+    snapshot_scheduler.stop()
+    log_archiver.stop()
+    job_runner.stop()
+    # Libera a liderança para outro worker
+    coordinator.resign()
+    coordinator.peers.stop()
+    stock_feed.close()
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def stream_export(export_format: str, filename: str, sheet_name: str, header: list[str], fetch_rows):
+    """
+    Monta a resposta de exportação em streaming.
+    As linhas são lidas com uma sessão própria enquanto o arquivo é enviado,
+    pois a sessão da requisição pode ser encerrada antes do fim da resposta.
+    """
+    def rows():
+        db = SessionLocal()
+        try:
+            yield from fetch_rows(db)
+        finally:
+            db.close()
+
+    body, media_type, extension = exports.render(export_format, sheet_name, header, rows())
+    headers = {'Content-Disposition': f'attachment; filename="{filename}.{extension}"'}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+def export_response(
+    background: bool, db: Session, username: str,
+    export_format: str, filename: str, sheet_name: str, source: str, filters: dict,
+):
+    """
+    Exportação de um catálogo de exports.SOURCES: em streaming na própria resposta ou,
+    com background, como tarefa (202 com o id; o arquivo fica para GET /jobs/{id}/download).
+    """
+    header, fetch_rows = exports.SOURCES[source]
+    if not background:
+        return stream_export(export_format, filename, sheet_name, header, lambda db: fetch_rows(db, **filters))
+    params = {
+        "source": source, "format": export_format, "filename": filename, "sheet_name": sheet_name,
+        "filters": {key: value.isoformat() if isinstance(value, datetime) else value for key, value in filters.items()},
+    }
+    job = job_runner.enqueue(db, "export", username, params)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_job(job))
+
+def jsonable_job(job: models.Job) -> dict:
+    download_url = f"{settings.ROOT_PATH}/jobs/{job.id}/download" if job.status == "succeeded" and job.file else None
+    data = schemas.Job.model_validate({
+        "id": job.id, "kind": job.kind, "status": job.status, "username": job.username,
+        "total": job.total, "processed": job_runner.progress(job), "result": job.result,
+        "errors": job.errors or [], "error": job.error, "download_url": download_url,
+        "created_at": job.created_at, "started_at": job.started_at, "finished_at": job.finished_at,
+    })
+    return data.model_dump(mode="json")
+
+
+def as_utc(value: datetime) -> datetime:
+    """Datas sem fuso vindas da query string são tratadas como UTC, o fuso gravado no banco."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def read_cursor(cursor: str | None) -> dict:
+    if not cursor:
+        return {}
     try:
-        crud.create_admin_if_not_exists(db)
-    finally:
-        db.close()
+        return pagination.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-def get_current_user(token: Annotated[str, Depends(crud.oauth2_scheme)], db: Session = Depends(get_db)):
+async def get_current_user(token: Annotated[str, Depends(crud.oauth2_scheme)], db=Depends(get_read_db)):
+    """
+    Resolve o usuário do token. O resultado fica no cache de usuários (por processo) e,
+    como o FastAPI memoriza dependências, é calculado uma única vez por requisição mesmo
+    quando a rota também depende de require_admin/require_regular_user.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Não foi possível validar as credenciais",
@@ -53,17 +235,24 @@ def get_current_user(token: Annotated[str, Depends(crud.oauth2_scheme)], db: Ses
     username: str = payload.get("sub")
     if username is None:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        # Lida antes da consulta, para que uma alteração concorrente não fique em cache como atual
+        generation = catalog_versions.get("users")
+        db_user = await run_db(db, crud.get_user_by_username, async_crud.get_user_by_username, username=username)
+        if db_user is None:
+            raise credentials_exception
+        # Guarda uma cópia desvinculada da sessão, que pode ser encerrada ou expirada depois
+        user = schemas.User.model_validate(db_user)
+        user_cache.set(username, user, generation)
     return user
 
-def require_admin(current_user: Annotated[models.User, Depends(get_current_user)]):
+async def require_admin(current_user: Annotated[schemas.User, Depends(get_current_user)]):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Acesso negado: Requer privilégios de administrador.")
     return current_user
 
-def require_regular_user(current_user: Annotated[models.User, Depends(get_current_user)]):
+async def require_regular_user(current_user: Annotated[schemas.User, Depends(get_current_user)]):
     if current_user.role == "admin":
         raise HTTPException(status_code=403, detail="Ação não permitida para administradores.")
     return current_user
@@ -75,106 +264,336 @@ async def root():
 
 @app.get("/login", response_class=HTMLResponse, include_in_schema=False)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request, "root_path": settings.ROOT_PATH})
+    return page_cache.response(request, "login.html")
 
 
 @app.get("/admin", response_class=HTMLResponse, include_in_schema=False)
 async def admin_page(request: Request):
-    return templates.TemplateResponse("admin.html", {"request": request, "root_path": settings.ROOT_PATH})
+    return page_cache.response(request, "admin.html")
 
 @app.get("/stock", response_class=HTMLResponse, include_in_schema=False)
 async def stock_page(request: Request):
-    return templates.TemplateResponse("stock.html", {"request": request, "root_path": settings.ROOT_PATH})
+    return page_cache.response(request, "stock.html")
 
 @app.get("/logs", response_class=HTMLResponse, include_in_schema=False)
 async def logs_page(request: Request):
-    return templates.TemplateResponse("logs.html", {"request": request, "root_path": settings.ROOT_PATH})
+    return page_cache.response(request, "logs.html")
 
 
 @app.post("/token", response_model=schemas.Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(get_db)):
-    user = crud.authenticate_user(db, username=form_data.username, password=form_data.password)
+    try:
+        login_rate_limiter.check(form_data.username)
+        # Consulta e bcrypt rodam no pool de login, fora do event loop
+        user = await login_gate.run(crud.authenticate_user, db, username=form_data.username, password=form_data.password)
+    except LoginRateLimited as e:
+        login_gate.outcomes["rate_limited"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Muitas tentativas de login. Aguarde e tente novamente.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except LoginOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado. Tente novamente em instantes.",
+            headers={"Retry-After": "1"},
+        )
     if not user:
+        login_gate.outcomes["failure"] += 1
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nome de usuário ou senha incorretos",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    login_gate.outcomes["success"] += 1
     access_token = crud.create_access_token(data={"sub": user.username, "role": user.role})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # ... NENHUMA MUDANÇA NAS ROTAS DE USUÁRIO ...
 @app.get("/users/me/", response_model=schemas.User)
-async def read_users_me(current_user: Annotated[models.User, Depends(get_current_user)]):
+async def read_users_me(current_user: Annotated[schemas.User, Depends(get_current_user)]):
     return current_user
 
+def collect_stats() -> dict:
+    return {
+        "users": user_cache.stats(),
+        "responses": {**response_cache.stats(), "versions": catalog_versions.stats()},
+        "audit": audit_writer.stats(),
+        "login": login_gate.stats(),
+        "stock_feed": stock_feed.stats(),
+        "log_archive": log_archiver.stats(),
+        "jobs": job_runner.stats(),
+        "startup": startup_report.stats(),
+        "coordination": coordinator.stats(),
+        "analytics": consumption_analytics.stats(),
+    }
+
+@app.get("/health/live", include_in_schema=False)
+def liveness():
+    """O processo está de pé e atendendo requisições."""
+    return {"status": "ok"}
+
+@app.get("/health/ready", include_in_schema=False)
+def readiness():
+    """Pronto para receber tráfego: esquema verificado e tarefas da partida concluídas."""
+    if not startup_report.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "starting", **startup_report.stats()})
+    return {"status": "ready", **startup_report.stats()}
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+def get_stats():
+    return collect_stats()
+
+async def require_metrics_access(authorization: Annotated[str | None, Header()] = None, db=Depends(get_read_db)):
+    """
+    /metrics expõe o tráfego por rota e o estado dos pools: exige METRICS_TOKEN (para o coletor)
+    ou o token de um administrador, a menos que METRICS_PUBLIC libere o acesso anônimo.
+    """
+    if settings.METRICS_PUBLIC:
+        return
+    if settings.METRICS_TOKEN and hmac.compare_digest(authorization or "", f"Bearer {settings.METRICS_TOKEN}"):
+        return
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token de métricas ou de administrador obrigatório.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    await require_admin(await get_current_user(token, db))
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+def get_metrics():
+    """Métricas no formato de texto do Prometheus."""
+    pools = {"sync": pool_stats(engine)}
+    if async_engine is not None:
+        pools["async"] = pool_stats(async_engine.sync_engine)
+    return Response(
+        content=render_prometheus(route_metrics, db_metrics, pools, collect_stats()),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 @app.get("/public/users", response_model=List[schemas.UserPublic])
-def get_public_user_list(db: Session = Depends(get_db)):
-    return crud.get_users(db)
+async def get_public_user_list(request: Request, db=Depends(get_read_db)):
+    return await cached_listing(
+        request, "users", List[schemas.UserPublic], (),
+        lambda: run_db(db, crud.get_users, async_crud.get_users),
+    )
 
 @app.get("/userslist", response_model=List[schemas.User], dependencies=[Depends(require_admin)])
-def get_user_list(db: Session = Depends(get_db)):
-    return crud.get_users(db)
+async def get_user_list(request: Request, db=Depends(get_read_db)):
+    return await cached_listing(
+        request, "users", List[schemas.User], (),
+        lambda: run_db(db, crud.get_users, async_crud.get_users),
+    )
 
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)):
+def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current_admin: schemas.User = Depends(require_admin)):
     db_user = crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Este nome de usuário já está em uso.")
     
-    new_user = crud.create_user(db=db, user=user)
+    new_user = crud.create_user(db=db, user=user, commit=False)
     crud.create_log_entry(db=db, username=current_admin.username, action=f"Criou o usuário '{new_user.username}'")
     return new_user
 
 @app.delete("/users/{user_id}", response_model=schemas.User)
-def delete_user(user_id: int, db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)):
+def delete_user(user_id: int, db: Session = Depends(get_db), current_admin: schemas.User = Depends(require_admin)):
     user_to_delete = db.query(models.User).filter(models.User.id == user_id).first()
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
     if user_to_delete.role == "admin":
         raise HTTPException(status_code=403, detail="Não é possível excluir a conta de administrador.")
     
-    deleted_user = crud.delete_user(db=db, user_id=user_id)
+    deleted_user = crud.delete_user(db=db, user_id=user_id, commit=False)
     crud.create_log_entry(db=db, username=current_admin.username, action=f"Excluiu o usuário '{deleted_user.username}' (ID: {user_id})")
     return deleted_user
 
 # --- ALTERAÇÕES E ADIÇÕES NA SEÇÃO DE ESTOQUE ---
 
 @app.post("/stock/", response_model=schemas.StockItem, dependencies=[Depends(require_regular_user)])
-def create_stock_item(item: schemas.StockItemCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_stock_item(item: schemas.StockItemCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     existing_item = crud.get_stock_item_by_name(db, name=item.name)
     if existing_item:
         raise HTTPException(status_code=400, detail=f"O item '{item.name}' já existe no inventário.")
 
-    new_item = crud.create_stock_item(db=db, item=item, user_id=current_user.id, username=current_user.username)
+    new_item = crud.create_stock_item(db=db, item=item, user_id=current_user.id, username=current_user.username, commit=False)
     crud.create_log_entry(db=db, username=current_user.username, action=f"Criou o item de inventário '{new_item.name}'")
     return new_item
 
-@app.get("/stock/", response_model=List[schemas.StockItem], dependencies=[Depends(require_regular_user)])
-def get_stock_list(search: str = "", db: Session = Depends(get_db)):
-    return crud.get_stock_items(db, search=search)
+@app.get("/stock/", response_model=schemas.StockItemPage | schemas.StockAsOfPage, dependencies=[Depends(require_regular_user)])
+async def get_stock_list(
+    request: Request,
+    search: str = "",
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    as_of: datetime | None = None,
+    db=Depends(get_read_db),
+):
+    position = read_cursor(cursor)
+    try:
+        after_id = int(position["id"]) if "id" in position else None
+        offset = int(position.get("offset", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+    if as_of is not None:
+        # Estoque de todos os itens na data pedida (a busca por nome não se aplica)
+        as_of = as_utc(as_of)
+        try:
+            items, has_more = await run_db(
+                db, crud.get_stock_as_of_page, async_crud.get_stock_as_of_page,
+                as_of, limit=limit, after_id=after_id,
+            )
+        except crud.NoStockHistoryError:
+            raise HTTPException(status_code=400, detail="Não há histórico de estoque para a data informada.")
+        next_cursor = pagination.encode_cursor({"id": items[-1]["id"]}) if has_more else None
+        return schemas.StockAsOfPage(as_of=as_of, items=items, next_cursor=next_cursor)
+
+    async def load_page():
+        items, has_more = await run_db(
+            db, crud.get_stock_items_page, async_crud.get_stock_items_page,
+            search=search, limit=limit, after_id=after_id, offset=offset,
+        )
+        next_cursor = None
+        if has_more:
+            if search.strip():
+                next_cursor = pagination.encode_cursor({"offset": offset + len(items)})
+            else:
+                next_cursor = pagination.encode_cursor({"id": items[-1].id})
+        return {"items": items, "next_cursor": next_cursor}
+
+    return await cached_listing(request, "stock", schemas.StockItemPage, (search, after_id, offset, limit), load_page)
+
+@app.get("/stock/events", dependencies=[Depends(require_regular_user)])
+async def stream_stock_events(last_event_id: str | None = Header(None)):
+    """
+    Feed de alterações do estoque em Server-Sent Events. Cada evento "stock" traz a lista
+    de mudanças de um commit; "reset" pede ao cliente que recarregue a listagem, porque
+    não foi possível retomar a partir do Last-Event-ID enviado.
+    """
+    subscription, backlog, current = stock_feed.subscribe(last_event_id)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            if backlog is None:
+                yield f"event: reset\nid: {stock_feed.event_id(current)}\ndata: {{}}\n\n"
+            else:
+                for seq, data in backlog:
+                    yield f"event: stock\nid: {stock_feed.event_id(seq)}\ndata: {data}\n\n"
+                yield f"event: ready\nid: {stock_feed.event_id(current)}\ndata: {{}}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=settings.STOCK_FEED_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    if subscription.overflowed:
+                        yield "event: reset\ndata: {}\n\n"
+                    break
+                seq, data = event
+                if seq > current:
+                    yield f"event: stock\nid: {stock_feed.event_id(seq)}\ndata: {data}\n\n"
+        finally:
+            stock_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/stock/analytics", response_model=schemas.StockAnalytics, dependencies=[Depends(require_regular_user)])
+async def get_stock_analytics(
+    request: Request,
+    window: int = Query(30, ge=1, le=settings.ANALYTICS_HISTORY_DAYS),
+    limit: int = Query(100, ge=1, le=1000),
+    max_days: float | None = Query(None, ge=0),
+    db: Session = Depends(get_db),
+):
+    """
+    Consumo (saídas) por item, médias diárias e previsão de ruptura, da mais próxima para a
+    mais distante. Com max_days, só os itens que devem acabar dentro desse prazo.
+    """
+    async def load():
+        return await run_in_threadpool(consumption_analytics.report, db, window=window, limit=limit, max_days=max_days)
+
+    # O dia entra na chave: as médias mudam na virada do dia mesmo sem movimentações
+    query = (window, limit, max_days, consumption_analytics.today().isoformat())
+    return await cached_listing(request, "stock", schemas.StockAnalytics, query, load)
+
+@app.get("/stock/analytics/{item_id}", response_model=schemas.ItemConsumptionHistory, dependencies=[Depends(require_regular_user)])
+def get_stock_item_analytics(
+    item_id: int,
+    window: int = Query(30, ge=1, le=settings.ANALYTICS_HISTORY_DAYS),
+    db: Session = Depends(get_db),
+):
+    item = crud.get_stock_item_by_id(db, item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Item não encontrado.")
+    return consumption_analytics.item_history(db, item, window=window)
+
+@app.get("/stock/{item_id}/history", response_model=schemas.StockHistoryPage, dependencies=[Depends(require_regular_user)])
+async def get_stock_item_history(
+    item_id: int,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    as_of: datetime | None = None,
+    db=Depends(get_read_db),
+):
+    position = read_cursor(cursor)
+    try:
+        before = (datetime.fromisoformat(position["ts"]), int(position["id"])) if position else None
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+    entries, has_more = await run_db(
+        db, crud.get_stock_history_page, async_crud.get_stock_history_page,
+        item_id, limit=limit, before=before, as_of=as_utc(as_of) if as_of else None,
+    )
+    next_cursor = None
+    if has_more:
+        next_cursor = pagination.encode_cursor({"ts": entries[-1].created_at.isoformat(), "id": entries[-1].id})
+    return {"items": entries, "next_cursor": next_cursor}
 
 @app.put("/stock/{item_id}", response_model=schemas.StockItem, dependencies=[Depends(require_regular_user)])
-def update_stock_item_quantity(item_id: int, movement: schemas.StockMovement, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    db_item = crud.get_stock_item_by_id(db, item_id)
+def update_stock_item_quantity(
+    item_id: int,
+    movement: schemas.StockMovement,
+    idempotency_key: Annotated[str | None, Header()] = None,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    try:
+        db_item, _ = crud.move_stock_item(
+            db, item_id, movement.type, movement.quantity,
+            username=current_user.username, idempotency_key=idempotency_key,
+        )
+    except crud.InsufficientStockError:
+        raise HTTPException(status_code=400, detail="A quantidade de saída não pode ser maior que o estoque atual.")
+    except crud.IdempotencyKeyConflict:
+        raise HTTPException(status_code=409, detail="Esta Idempotency-Key já foi usada com outra movimentação.")
     if not db_item:
         raise HTTPException(status_code=404, detail="Item não encontrado.")
-    
-    if movement.type == 'entrada':
-        db_item.quantity += movement.quantity
-    elif movement.type == 'saida':
-        if db_item.quantity < movement.quantity:
-            raise HTTPException(status_code=400, detail="A quantidade de saída não pode ser maior que o estoque atual.")
-        db_item.quantity -= movement.quantity
-    
-    db.commit()
-    db.refresh(db_item)
-    action = f"Deu {movement.type} de {movement.quantity} unidades no item '{db_item.name}' (Estoque atual: {db_item.quantity})"
-    crud.create_log_entry(db=db, username=current_user.username, action=action)
     return db_item
 
+@app.post("/stock/movements/batch", response_model=schemas.StockMovementBatchResult, dependencies=[Depends(require_regular_user)])
+def apply_stock_movements_batch(batch: schemas.StockMovementBatch, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    try:
+        committed, results = crud.apply_stock_movements_batch(
+            db, batch.movements, username=current_user.username,
+            all_or_nothing=batch.mode == "all_or_nothing",
+        )
+    except crud.StockConflictError:
+        raise HTTPException(status_code=409, detail="O estoque foi alterado por outra operação durante o lote. Tente novamente.")
+    applied = sum(1 for r in results if r["status"] == "applied")
+    return {"committed": committed, "applied": applied, "failed": len(results) - applied, "results": results}
+
 @app.delete("/stock/{item_id}", response_model=schemas.StockItem, dependencies=[Depends(require_regular_user)])
-def delete_stock_item(item_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_stock_item(item_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     item_to_delete = crud.get_stock_item_by_id(db, item_id)
     if not item_to_delete:
         raise HTTPException(status_code=404, detail="Item não encontrado.")
@@ -183,114 +602,165 @@ def delete_stock_item(item_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=400, detail=f"Não é possível excluir o item '{item_to_delete.name}' pois seu estoque não está zerado.")
     
     item_name = item_to_delete.name
-    deleted_item = crud.delete_stock_item(db=db, item_id=item_id)
+    deleted_item = crud.delete_stock_item(db=db, item_id=item_id, username=current_user.username, commit=False)
     crud.create_log_entry(db=db, username=current_user.username, action=f"Excluiu o item de inventário '{item_name}'")
     return deleted_item
 
-# --- ROTA EXISTENTE DE EXPORTAÇÃO (SEM MUDANÇAS) ---
-@app.get("/stock/export/excel", dependencies=[Depends(require_regular_user)])
-def export_stock_to_excel(search: str = "", db: Session = Depends(get_db)):
-    items = crud.get_stock_items(db, search=search)
-    stock_data = [
-        {"ID do Item": item.id, "Nome do Item": item.name, "Quantidade": item.quantity, "Criado Por": item.created_by_username}
-        for item in items
-    ]
-    df = pd.DataFrame(stock_data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Inventario')
-    output.seek(0)
-    filename = f"relatorio_inventario_{search}.xlsx" if search else "relatorio_inventario_filtrado.xlsx"
-    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+# --- ROTAS DE EXPORTAÇÃO (xlsx ou csv, geradas em streaming) ---
+@app.get("/stock/export/excel")
+def export_stock_to_excel(
+    search: str = "",
+    format: Literal["xlsx", "csv"] = "xlsx",
+    background: bool = False,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(require_regular_user),
+):
+    filename = f"relatorio_inventario_{search}" if search else "relatorio_inventario_filtrado"
+    return export_response(background, db, current_user.username, format, filename, "Inventario", "stock", {"search": search})
 
 # --- NOVA ROTA PARA EXPORTAR INVENTÁRIO COMPLETO ---
-@app.get("/stock/export/excel-all", dependencies=[Depends(require_regular_user)])
-def export_all_stock_to_excel(db: Session = Depends(get_db)):
+@app.get("/stock/export/excel-all")
+def export_all_stock_to_excel(
+    format: Literal["xlsx", "csv"] = "xlsx",
+    background: bool = False,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(require_regular_user),
+):
     # Busca todos os itens, sem filtro de busca
-    items = crud.get_stock_items(db, search="")
-    stock_data = [
-        {"ID do Item": item.id, "Nome do Item": item.name, "Quantidade": item.quantity, "Criado Por": item.created_by_username}
-        for item in items
-    ]
-    df = pd.DataFrame(stock_data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Inventario_Completo')
-    output.seek(0)
-    headers = {'Content-Disposition': 'attachment; filename="relatorio_inventario_completo.xlsx"'}
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+    return export_response(background, db, current_user.username, format,
+                           "relatorio_inventario_completo", "Inventario_Completo", "stock", {"search": ""})
 
 
 # --- NOVA ROTA PARA IMPORTAR E ATUALIZAR ESTOQUE VIA PLANILHA ---
-@app.post("/stock/import/excel", dependencies=[Depends(require_regular_user)])
+def process_stock_import(contents: bytes, db: Session, username: str):
+    """Lê a planilha enviada e aplica as quantidades. Bloqueante: chamada fora do event loop."""
+    try:
+        report, rows = stock_import.read_stock_spreadsheet(io.BytesIO(contents))
+    except stock_import.SpreadsheetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    report += crud.bulk_set_stock_quantities(db, rows, username=username, commit=False)
+    report.sort(key=lambda r: r["row"])
+
+    updated_count = sum(1 for r in report if r["status"] == "updated")
+    not_found_ids = [str(r["item_id"]) for r in report if r["status"] == "not_found"]
+    invalid_count = sum(1 for r in report if r["status"] == "invalid")
+    superseded_count = sum(1 for r in report if r["status"] == "superseded")
+
+    # Cria um log da ação
+    log_action = stock_import.import_log_action(updated_count, not_found_ids, invalid_count, superseded_count)
+    crud.create_log_entry(db, username=username, action=log_action)
+
+    return {
+        "message": log_action,
+        "updated": updated_count,
+        "not_found": len(not_found_ids),
+        "invalid": invalid_count,
+        "superseded": superseded_count,
+        "rows": report,
+    }
+
+
+@app.post(
+    "/stock/import/excel",
+    response_model=schemas.StockImportReport,
+    responses={202: {"model": schemas.Job, "description": "Importação registrada como tarefa (?background=true)"}},
+    dependencies=[Depends(require_regular_user)],
+)
 async def import_stock_from_excel(
     file: UploadFile = File(...), 
+    background: bool = False,
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+    current_user: schemas.User = Depends(get_current_user)
 ):
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Formato de arquivo inválido. Por favor, envie um arquivo Excel (.xlsx ou .xls).")
 
+    if background:
+        # A planilha vai para o disco e é processada pelo pool de tarefas (ver jobs.py)
+        suffix = ".xls" if file.filename.endswith(".xls") else ".xlsx"
+        job = await run_in_threadpool(job_runner.enqueue, db, "stock_import", current_user.username,
+                                      {"filename": file.filename}, file.file, suffix)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_job(job))
+
     try:
         contents = await file.read()
-        df = pd.read_excel(io.BytesIO(contents))
-
-        # Verifica se as colunas necessárias existem
-        required_columns = ["ID do Item", "Quantidade"]
-        if not all(col in df.columns for col in required_columns):
-            raise HTTPException(status_code=400, detail=f"A planilha deve conter as colunas: {', '.join(required_columns)}")
-
-        updated_count = 0
-        not_found_ids = []
-
-        for _, row in df.iterrows():
-            item_id = row["ID do Item"]
-            new_quantity = row["Quantidade"]
-            
-            # Validação simples
-            if pd.isna(item_id) or pd.isna(new_quantity):
-                continue
-
-            item = crud.get_stock_item_by_id(db, int(item_id))
-
-            if item:
-                # Atualiza a quantidade do item
-                item.quantity = int(new_quantity)
-                updated_count += 1
-            else:
-                not_found_ids.append(str(item_id))
-        
-        db.commit()
-
-        # Cria um log da ação
-        log_action = f"Atualizou o estoque via planilha. {updated_count} itens atualizados."
-        if not_found_ids:
-            log_action += f" IDs não encontrados: {', '.join(not_found_ids)}."
-        crud.create_log_entry(db, username=current_user.username, action=log_action)
-
-        return {"message": log_action}
+        # A leitura com pandas e as consultas ao banco são bloqueantes: rodam no pool de threads
+        return await run_in_threadpool(process_stock_import, contents, db, current_user.username)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro ao processar o arquivo: {e}")
 
 
+# --- TAREFAS EM SEGUNDO PLANO (importação/exportação com ?background=true) ---
+def get_visible_job(job_id: str, db: Session, current_user: schemas.User) -> models.Job:
+    """A tarefa, se existir e pertencer ao usuário (administradores veem todas)."""
+    job = crud.get_job(db, job_id)
+    if job is None or (job.username != current_user.username and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada.")
+    return job
+
+@app.get("/jobs/{job_id}", response_model=schemas.Job)
+def get_job_status(job_id: str, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    return jsonable_job(get_visible_job(job_id, db, current_user))
+
+@app.get("/jobs/{job_id}/download")
+def download_job_file(job_id: str, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    job = get_visible_job(job_id, db, current_user)
+    if job.status != "succeeded" or not job.file:
+        raise HTTPException(status_code=409, detail="A tarefa ainda não gerou um arquivo para download.")
+    path = job_runner.path(job.file)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="O arquivo desta tarefa já foi removido.")
+    media_type = exports.CSV_MEDIA_TYPE if job.file.endswith(".csv") else exports.XLSX_MEDIA_TYPE
+    return FileResponse(path, media_type=media_type, filename=job.result["filename"])
+
+
 # ... NENHUMA MUDANÇA NAS ROTAS DE LOGS ...
-@app.get("/logs/", response_model=List[schemas.LogEntry], dependencies=[Depends(require_admin)])
-def get_logs(db: Session = Depends(get_db)):
-    return crud.get_log_entries(db)
-
-@app.get("/logs/export/excel", dependencies=[Depends(require_admin)])
-def export_logs_to_excel(db: Session = Depends(get_db)):
-    logs = crud.get_log_entries(db, limit=10000)
-    logs_data = [
-        {"ID": log.id, "Data e Hora": log.timestamp.strftime("%Y-%m-%d %H:%M:%S"), "Usuário": log.username, "Ação Realizada": log.action}
-        for log in logs
-    ]
-    df = pd.DataFrame(logs_data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Relatorio_Atividades')
-    output.seek(0)
-    headers = {'Content-Disposition': 'attachment; filename="relatorio_de_atividades.xlsx"'}
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
\ No newline at end of file
+@app.get("/logs/", response_model=schemas.LogEntryPage, dependencies=[Depends(require_admin)])
+async def get_logs(
+    cursor: str | None = None,
+    limit: int = Query(200, ge=1, le=1000),
+    username: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    action: str | None = None,
+    db=Depends(get_read_db),
+):
+    position = read_cursor(cursor)
+    try:
+        before = (datetime.fromisoformat(position["ts"]), int(position["id"])) if position else None
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+    logs, has_more = await run_db(
+        db, crud.get_log_entries_page, async_crud.get_log_entries_page,
+        limit=limit, before=before, username=username, date_from=date_from, date_to=date_to, action=action,
+    )
+    next_cursor = None
+    if has_more:
+        next_cursor = pagination.encode_cursor({"ts": logs[-1].timestamp.isoformat(), "id": logs[-1].id})
+    return {"items": logs, "next_cursor": next_cursor}
+
+@app.get("/logs/export/excel")
+def export_logs_to_excel(
+    format: Literal["xlsx", "csv"] = "xlsx",
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    include_archived: bool = False,
+    background: bool = False,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(require_admin),
+):
+    """Exporta os logs da tabela e, com include_archived, também os já arquivados em disco (mais antigos)."""
+    filters = {
+        "date_from": as_utc(date_from) if date_from else None,
+        "date_to": as_utc(date_to) if date_to else None,
+        "include_archived": include_archived,
+    }
+    return export_response(background, db, current_user.username, format,
+                           "relatorio_de_atividades", "Relatorio_Atividades", "logs", filters)
+
+startup_report.record_import(_import_started)
@@ -0,0 +1,34 @@
+"""
+Variantes assíncronas (AsyncSession) das consultas de leitura de crud.py,
+usadas pelas rotas quando USE_ASYNC_DB está ativo. As consultas são as mesmas.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud, models
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+    return (await db.scalars(select(models.User).offset(skip).limit(limit))).all()
+
+
+async def get_stock_items_page(db: AsyncSession, search: str = "", limit: int = 100, after_id: int | None = None, offset: int = 0):
+    items = (await db.scalars(crud.stock_items_page_query(search, limit, after_id, offset))).all()
+    return items[:limit], len(items) > limit
+
+
+async def get_log_entries_page(db: AsyncSession, limit: int = 200, **filters):
+    logs = (await db.scalars(crud.log_entries_page_query(limit, **filters))).all()
+    return logs[:limit], len(logs) > limit
+
+
+async def get_stock_history_page(db: AsyncSession, item_id: int, **kwargs):
+    return await db.run_sync(crud.get_stock_history_page, item_id, **kwargs)
+
+
+async def get_stock_as_of_page(db: AsyncSession, as_of, **kwargs):
+    return await db.run_sync(crud.get_stock_as_of_page, as_of, **kwargs)
@@ -0,0 +1,141 @@
+"""
+Gravação dos logs de atividade (log_entries).
+
+Dois modos, escolhidos por settings.AUDIT_MODE:
+- "transactional": o log é inserido na mesma transação (e no mesmo commit) da alteração;
+- "batched": o log entra numa fila limitada e uma thread em segundo plano grava os
+  registros em INSERTs de várias linhas, quando o lote enche ou o intervalo expira.
+  A requisição não espera pela gravação; se a fila estiver cheia, o log é gravado
+  na hora para não ser perdido.
+"""
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+import models
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    def __init__(self, session_factory, batch_size: int, flush_interval: float, max_queue: int):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.sync_writes = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10.0):
+        """Para a thread depois de gravar tudo o que ainda está na fila."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, rows: list[dict]):
+        """Enfileira registros (username, action, timestamp). Sem a thread ativa, grava na hora."""
+        if not self.running:
+            self._write(rows, sync=True)
+            return
+        overflow = []
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                overflow.append(row)
+        if overflow:
+            self._write(overflow, sync=True)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _collect(self) -> list[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            # Ao encerrar, esvazia a fila sem esperar pelo intervalo
+            remaining = 0 if self._stop.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                if self._stop.is_set() or remaining <= 0:
+                    break
+        return batch
+
+    def _write(self, rows: list[dict], sync: bool = False):
+        start = time.perf_counter()
+        db = self._session_factory()
+        try:
+            db.execute(insert(models.LogEntry), rows)
+            db.commit()
+            ok = True
+        except Exception:
+            logger.exception("Falha ao gravar %d registros de log", len(rows))
+            ok = False
+        finally:
+            db.close()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if ok:
+                self.written += len(rows)
+            else:
+                self.failed += len(rows)
+            if sync:
+                self.sync_writes += len(rows)
+            self.flushes += 1
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            self.last_flush_seconds = elapsed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": settings.AUDIT_MODE,
+                "running": self.running,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "written": self.written,
+                "failed": self.failed,
+                "sync_writes": self.sync_writes,
+                "flushes": self.flushes,
+                "flush_seconds_avg": self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+                "flush_seconds_max": self.flush_seconds_max,
+                "last_flush_seconds": self.last_flush_seconds,
+            }
+
+
+audit_writer = AuditWriter(
+    SessionLocal,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+    max_queue=settings.AUDIT_QUEUE_SIZE,
+)
@@ -0,0 +1,137 @@
+"""
+Relatório de partida a frio: tempo de importação do app e tempo até a primeira requisição.
+
+Uso, na raiz do projeto e com as mesmas variáveis de ambiente da aplicação:
+
+    python -m benchmarks.cold_start --runs 5
+
+1. Importação: roda `python -X importtime -c "import app"` em subprocessos novos e mostra
+   a mediana do tempo total e os módulos mais caros.
+2. Partida: sobe o uvicorn `--runs` vezes sobre um SQLite temporário e mede, a partir do
+   início do processo, quando /health/live responde, quando /health/ready fica pronto e
+   quanto leva a primeira requisição de verdade (GET /public/users). A primeira partida
+   cria o esquema; as seguintes encontram a versão gravada e o pulam.
+Requer httpx (benchmarks/requirements.txt).
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def import_profile(runs: int, top: int) -> dict:
+    totals, modules = [], {}
+    for _ in range(runs):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"], capture_output=True, text=True, check=True,
+        ).stderr
+        # As linhas saem na ordem em que cada importação termina: os filhos diretos do app
+        # (recuo de 3 espaços) aparecem antes da linha do próprio app (recuo de 1)
+        children = {}
+        for line in stderr.splitlines():
+            match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)", line)
+            if not match:
+                continue
+            cumulative, indent, name = int(match.group(1)) / 1e6, len(match.group(2)), match.group(3)
+            if indent == 3:
+                children[name] = cumulative
+            elif indent == 1:
+                if name == "app":
+                    totals.append(cumulative)
+                    for child, seconds in children.items():
+                        modules.setdefault(child, []).append(seconds)
+                children = {}
+    heaviest = sorted(((statistics.median(v), k) for k, v in modules.items()), reverse=True)[:top]
+    return {
+        "import_seconds": statistics.median(totals),
+        "heaviest": {name: round(seconds, 4) for seconds, name in heaviest},
+        "heavy_modules_loaded": heavy_modules_loaded(),
+    }
+
+
+def heavy_modules_loaded() -> dict:
+    code = "import json, sys, app; print(json.dumps({m: m in sys.modules for m in ('pandas', 'numpy', 'openpyxl')}))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def boot_once(env: dict) -> dict:
+    import httpx
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    marks = {}
+    try:
+        with httpx.Client(base_url=base, timeout=5) as client:
+            for name, path, done in (
+                ("live_seconds", "/health/live", lambda r: r.status_code == 200),
+                ("ready_seconds", "/health/ready", lambda r: r.status_code == 200),
+                ("first_request_seconds", "/public/users", lambda r: r.status_code == 200),
+            ):
+                deadline = time.perf_counter() + 60
+                while True:
+                    try:
+                        if done(client.get(path)):
+                            break
+                    except httpx.TransportError:
+                        pass
+                    if time.perf_counter() > deadline or process.poll() is not None:
+                        raise RuntimeError(f"A aplicação não respondeu em {path}")
+                    time.sleep(0.005)
+                marks[name] = round(time.perf_counter() - start, 4)
+            marks["startup"] = client.get("/health/ready").json()["seconds"]
+    finally:
+        process.terminate()
+        process.wait(10)
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de importação e de partida da aplicação.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="módulos mais caros listados")
+    parser.add_argument("--output", help="arquivo JSON com o relatório")
+    args = parser.parse_args()
+
+    report = {"imports": import_profile(args.runs, args.top), "boots": []}
+    with tempfile.TemporaryDirectory(prefix="estoque-cold-start-") as tmpdir:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmpdir, 'cold.db')}"}
+        env.setdefault("SECRET_KEY", "cold-start")
+        env.setdefault("ADMIN_DEFAULT_USERNAME", "admin")
+        env.setdefault("ADMIN_DEFAULT_PASSWORD", "cold-start")
+        for _ in range(args.runs):
+            report["boots"].append(boot_once(env))
+
+    imports = report["imports"]
+    print(f"Importação do app (mediana de {args.runs}): {imports['import_seconds'] * 1000:.0f} ms")
+    print("Módulos mais caros:", ", ".join(f"{name} {s * 1000:.0f} ms" for name, s in imports["heaviest"].items()))
+    print("Carregados na importação:", ", ".join(f"{name}={loaded}" for name, loaded in imports["heavy_modules_loaded"].items()))
+    print(f"\n{'partida':<12}{'live ms':>9}{'ready ms':>10}{'1ª req. ms':>12}{'esquema ms':>12}")
+    for n, boot in enumerate(report["boots"]):
+        label = "primeira" if n == 0 else f"seguinte {n}"
+        print(f"{label:<12}{boot['live_seconds'] * 1000:>9.0f}{boot['ready_seconds'] * 1000:>10.0f}"
+              f"{boot['first_request_seconds'] * 1000:>12.0f}{boot['startup']['schema'] * 1000:>12.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
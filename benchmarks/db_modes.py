@@ -0,0 +1,115 @@
+"""
+Teste de carga comparando a camada de banco síncrona com a assíncrona (USE_ASYNC_DB).
+
+Uso, na raiz do projeto e com as mesmas variáveis de ambiente da aplicação:
+
+    python -m benchmarks.db_modes --requests 2000 --concurrency 50 --items 5000
+
+Cada modo roda num subprocesso (as configurações são lidas na importação dos módulos),
+com a aplicação servida no próprio processo via httpx.ASGITransport. As requisições
+alternam entre GET /stock/ (primeira página) e GET /stock/?search=... e são disparadas
+com a concorrência pedida. O banco recebe `--items` itens de teste: use um banco descartável.
+Requer httpx (benchmarks/requirements.txt).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_USERNAME = "benchmark"
+
+
+def seed(items: int):
+    import crud, models
+    from database import SessionLocal
+    from sqlalchemy import func, insert, select
+
+    db = SessionLocal()
+    try:
+        if not crud.get_user_by_username(db, BENCH_USERNAME):
+            db.add(models.User(username=BENCH_USERNAME, role="user"))
+            db.commit()
+        existing = db.scalar(select(func.count()).select_from(models.StockItem))
+        if existing < items:
+            db.execute(insert(models.StockItem), [
+                {"name": f"Item de teste {n:07d}", "quantity": n % 100, "created_by_username": BENCH_USERNAME}
+                for n in range(existing, items)
+            ])
+            db.commit()
+    finally:
+        db.close()
+
+
+async def child(requests: int, concurrency: int, items: int) -> dict:
+    import httpx
+    import crud
+    from app import app
+
+    async with app.router.lifespan_context(app):
+        seed(items)
+        token = crud.create_access_token({"sub": BENCH_USERNAME, "role": "user"})
+        headers = {"Authorization": f"Bearer {token}"}
+        paths = ["/stock/", "/stock/?search=teste 00012"]
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def one(n: int):
+                nonlocal errors
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.get(paths[n % len(paths)], headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(n) for n in range(requests)))
+            elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "per_second": requests / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara os modos síncrono e assíncrono da camada de banco.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child(args.requests, args.concurrency, args.items))))
+        return
+
+    print(f"{'modo':<8}{'req.':>7}{'erros':>7}{'req./s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for mode, use_async in (("sync", "false"), ("async", "true")):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.db_modes", "--child",
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--items", str(args.items)],
+            env={**os.environ, "USE_ASYNC_DB": use_async},
+            capture_output=True, text=True, check=True,
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<8}{r['requests']:>7}{r['errors']:>7}{r['per_second']:>9.0f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Latência de GET /stock/ enquanto o login (bcrypt) é martelado.
+
+Uso, na raiz do projeto e com as mesmas variáveis de ambiente da aplicação:
+
+    python -m benchmarks.login_load --requests 1000 --concurrency 20 --logins 8
+
+Mede p50/p95/p99 de GET /stock/ sozinho e depois com `--logins` clientes fazendo login
+de administrador sem parar. O limite de tentativas e o cache de verificações são
+desligados para que cada login pague o bcrypt inteiro. O banco recebe `--items` itens
+de teste: use um banco descartável. Requer httpx (benchmarks/requirements.txt).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from benchmarks.db_modes import BENCH_USERNAME, seed
+
+
+def summary(latencies: list[float]) -> str:
+    q = statistics.quantiles(latencies, n=100)
+    return f"p50 {q[49] * 1000:7.1f} ms   p95 {q[94] * 1000:7.1f} ms   p99 {q[98] * 1000:7.1f} ms"
+
+
+async def run(requests: int, concurrency: int, logins: int, items: int):
+    import httpx
+    import crud
+    from app import app
+    from config import settings
+
+    async with app.router.lifespan_context(app):
+        seed(items)
+        headers = {"Authorization": f"Bearer {crud.create_access_token({'sub': BENCH_USERNAME, 'role': 'user'})}"}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def stock_phase() -> list[float]:
+                latencies = []
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def one():
+                    async with semaphore:
+                        start = time.perf_counter()
+                        await client.get("/stock/", headers=headers)
+                        latencies.append(time.perf_counter() - start)
+
+                await asyncio.gather(*(one() for _ in range(requests)))
+                return latencies
+
+            baseline = await stock_phase()
+
+            stop = asyncio.Event()
+            login_latencies = []
+
+            async def hammer():
+                form = {"username": settings.ADMIN_DEFAULT_USERNAME, "password": settings.ADMIN_DEFAULT_PASSWORD}
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    await client.post("/token", data=form)
+                    login_latencies.append(time.perf_counter() - start)
+
+            hammers = [asyncio.create_task(hammer()) for _ in range(logins)]
+            loaded = await stock_phase()
+            stop.set()
+            await asyncio.gather(*hammers)
+
+    print(f"GET /stock/ sem logins:        {summary(baseline)}")
+    print(f"GET /stock/ com {logins:>2} logins:     {summary(loaded)}")
+    if len(login_latencies) > 1:
+        print(f"POST /token ({len(login_latencies)} logins):     {summary(login_latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência de GET /stock/ sob carga de login.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=8, help="clientes fazendo login simultaneamente")
+    parser.add_argument("--items", type=int, default=5000)
+    args = parser.parse_args()
+
+    # Precisam valer antes de as configurações serem carregadas
+    os.environ["LOGIN_RATE_LIMIT"] = "1000000000"
+    os.environ["PASSWORD_CACHE_TTL_SECONDS"] = "0"
+    asyncio.run(run(args.requests, args.concurrency, args.logins, args.items))
+
+
+if __name__ == "__main__":
+    main()
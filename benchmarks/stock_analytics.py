@@ -0,0 +1,115 @@
+"""
+Benchmark da análise de consumo (stock_analytics.ConsumptionAnalytics, GET /stock/analytics).
+
+Uso, na raiz do projeto e com as mesmas variáveis de ambiente da aplicação:
+
+    python -m benchmarks.stock_analytics --rows 1000000 --items 5000 --days 365
+
+Grava `rows` saídas no razão, espalhadas entre `items` itens e os últimos `days` dias, e mede:
+
+- cold: primeiro relatório do processo (soma no banco de todos os dias encerrados);
+- warm: relatórios seguintes (só as saídas de hoje vão ao banco; o resto é NumPy em memória);
+- rollover: virada do dia (só o dia recém-encerrado é somado no banco);
+- item: série diária de um item com média móvel.
+
+As linhas gravadas (e os itens) são removidas no fim.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert
+
+import models
+import stock_analytics
+from database import Base, SessionLocal, engine
+
+BENCH_USERNAME = "benchmark-analytics"
+INSERT_BATCH = 50000
+
+
+def seed(db, rows: int, items: int, days: int) -> list[int]:
+    prefix = uuid.uuid4().hex[:8]
+    db.execute(insert(models.StockItem), [
+        {"name": f"bench-{prefix}-{i}", "quantity": random.randint(0, 5000), "created_by_username": BENCH_USERNAME}
+        for i in range(items)
+    ])
+    db.commit()
+    ids = [row.id for row in db.query(models.StockItem.id).filter(models.StockItem.created_by_username == BENCH_USERNAME)]
+    now = datetime.now(timezone.utc)
+    span = days * 86400
+    for start in range(0, rows, INSERT_BATCH):
+        db.execute(insert(models.StockLedgerEntry), [
+            {
+                "item_id": random.choice(ids), "item_name": "bench", "kind": "saida",
+                "delta": -random.randint(1, 20), "balance": 0, "username": BENCH_USERNAME,
+                "created_at": now - timedelta(seconds=random.randrange(span)),
+            }
+            for _ in range(min(INSERT_BATCH, rows - start))
+        ])
+        db.commit()
+    return ids
+
+
+def cleanup(db):
+    db.execute(delete(models.StockLedgerEntry).where(models.StockLedgerEntry.username == BENCH_USERNAME))
+    db.execute(delete(models.StockItem).where(models.StockItem.created_by_username == BENCH_USERNAME))
+    db.commit()
+
+
+def timed(fn, repeat: int = 1) -> float:
+    """Mediana, em milissegundos, de `repeat` execuções."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000000, help="saídas gravadas no razão")
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--window", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        ids = seed(db, args.rows, args.items, args.days)
+        print(f"{args.rows} saídas gravadas em {time.perf_counter() - start:.1f} s")
+
+        analytics = stock_analytics.ConsumptionAnalytics(max(args.days, args.window))
+        report = lambda: analytics.report(db, window=args.window)
+        results = {"cold": timed(report), "warm": timed(report, args.repeat)}
+
+        def rollover():
+            # Descarta o último dia encerrado, como se o dia tivesse acabado de virar
+            last = stock_analytics.epoch_day(analytics._closed_through)
+            keep = analytics._closed.days < last
+            analytics._closed = stock_analytics.DailyConsumption(*(a[keep] for a in analytics._closed))
+            analytics._closed_through -= timedelta(days=1)
+            report()
+
+        results["rollover"] = timed(rollover, min(args.repeat, 5))
+        item = db.get(models.StockItem, ids[0])
+        results["item"] = timed(lambda: analytics.item_history(db, item, window=args.window), args.repeat)
+
+        print(f"{'etapa':<10}{'ms':>10}")
+        for name, ms in results.items():
+            print(f"{name:<10}{ms:>10.1f}")
+        print(f"linhas em memória: {analytics.stats()['rows']}")
+    finally:
+        cleanup(db)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
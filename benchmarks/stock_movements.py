@@ -0,0 +1,119 @@
+"""
+Benchmark de movimentações concorrentes sobre um único item ("item quente").
+
+Uso, na raiz do projeto e com as mesmas variáveis de ambiente da aplicação:
+
+    python -m benchmarks.stock_movements --threads 16 --movements 200
+
+Cada thread faz pares de movimentações (entrada de 2, saída de 1) no mesmo item, então o
+estoque final esperado é threads * movements. Os modos comparados são:
+
+- legacy: ler-modificar-gravar em Python, como a rota fazia antes (perde atualizações);
+- atomic: crud.move_stock_item, com UPDATE condicional atômico;
+- idempotent: crud.move_stock_item com Idempotency-Key, reenviando cada movimentação
+  duas vezes com a mesma chave (o reenvio não pode contar em dobro).
+"""
+import argparse
+import threading
+import time
+import uuid
+
+from sqlalchemy import delete
+
+import crud, models
+from database import Base, SessionLocal, engine
+
+BENCH_USERNAME = "benchmark"
+
+
+def legacy_move(db, item_id: int, movement_type: str, quantity: int):
+    db_item = crud.get_stock_item_by_id(db, item_id)
+    if movement_type == "entrada":
+        db_item.quantity += quantity
+    elif db_item.quantity >= quantity:
+        db_item.quantity -= quantity
+    db.commit()
+
+
+def atomic_move(db, item_id: int, movement_type: str, quantity: int):
+    crud.move_stock_item(db, item_id, movement_type, quantity, username=BENCH_USERNAME)
+
+
+def idempotent_move(db, item_id: int, movement_type: str, quantity: int):
+    key = str(uuid.uuid4())
+    for _ in range(2):
+        crud.move_stock_item(db, item_id, movement_type, quantity, username=BENCH_USERNAME, idempotency_key=key)
+
+
+MODES = {"legacy": legacy_move, "atomic": atomic_move, "idempotent": idempotent_move}
+
+
+def run(mode: str, threads: int, movements: int) -> dict:
+    move = MODES[mode]
+    db = SessionLocal()
+    item = models.StockItem(name=f"bench-{uuid.uuid4()}", quantity=0, created_by_username=BENCH_USERNAME)
+    db.add(item)
+    db.commit()
+    item_id = item.id
+
+    errors = []
+
+    def worker():
+        session = SessionLocal()
+        try:
+            for _ in range(movements):
+                try:
+                    move(session, item_id, "entrada", 2)
+                    move(session, item_id, "saida", 1)
+                except Exception as e:
+                    session.rollback()
+                    errors.append(e)
+        finally:
+            session.close()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    db.expire_all()
+    final = crud.get_stock_item_by_id(db, item_id).quantity
+    db.execute(delete(models.StockItem).where(models.StockItem.id == item_id))
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.username == BENCH_USERNAME))
+    db.execute(delete(models.LogEntry).where(models.LogEntry.username == BENCH_USERNAME))
+    db.commit()
+    db.close()
+
+    total = threads * movements * 2
+    return {
+        "mode": mode,
+        "movements": total,
+        "seconds": elapsed,
+        "per_second": total / elapsed if elapsed else 0.0,
+        "expected": threads * movements,
+        "final": final,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--movements", type=int, default=100, help="pares entrada/saída por thread")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    print(f"{'modo':<12}{'movim.':>8}{'seg.':>9}{'movim./s':>11}{'esperado':>10}{'final':>8}{'erros':>7}  resultado")
+    for mode in args.modes:
+        r = run(mode, args.threads, args.movements)
+        verdict = "OK" if r["final"] == r["expected"] and not r["errors"] else "DIVERGENTE"
+        print(f"{r['mode']:<12}{r['movements']:>8}{r['seconds']:>9.2f}{r['per_second']:>11.0f}"
+              f"{r['expected']:>10}{r['final']:>8}{r['errors']:>7}  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
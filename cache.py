@@ -0,0 +1,118 @@
+"""
+Cache em memória (por processo) com expiração por tempo e descarte LRU.
+As versões dos catálogos são compartilhadas entre os workers (coordination.py): um
+commit em qualquer processo invalida o que os outros têm em cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from config import settings
+from coordination import SharedCounters, coordinator
+
+
+class TTLCache:
+    """
+    Dicionário limitado a `max_size` entradas, cada uma válida por `ttl` segundos.
+    Seguro para uso entre as threads que atendem as rotas síncronas.
+    Com `generation`, uma entrada gravada numa geração anterior à atual é descartada.
+    """
+
+    def __init__(self, ttl: float, max_size: int, generation: Callable[[], int] | None = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.generation = generation
+        self._data: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _current_generation(self) -> int:
+        return self.generation() if self.generation is not None else 0
+
+    def get(self, key: Hashable) -> Any | None:
+        generation = self._current_generation()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != generation:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key: Hashable, value: Any, generation: int | None = None):
+        """`generation`: a geração lida antes de obter o valor (por padrão, a atual)."""
+        if generation is None:
+            generation = self._current_generation()
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, generation, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class CatalogVersions:
+    """
+    Contador de versão por catálogo ("stock", "users"), incrementado a cada commit que
+    altera o catálogo, compartilhado entre os workers. Junto com `epoch` (renovado a cada
+    troca do worker líder) identifica o conteúdo das listagens, sem repetir valores depois
+    de um reinício.
+    """
+
+    def __init__(self, counters: SharedCounters):
+        self._counters = counters
+
+    @property
+    def epoch(self) -> str:
+        return self._counters.epoch
+
+    def get(self, catalog: str) -> int:
+        return self._counters.get(catalog)
+
+    def bump(self, catalog: str) -> int:
+        return self._counters.bump(catalog)
+
+    def stats(self) -> dict:
+        return {"epoch": self.epoch, "stock": self.get("stock"), "users": self.get("users")}
+
+
+catalog_versions = CatalogVersions(coordinator.counters)
+
+# Corpo JSON das listagens, indexado por (catálogo, versão, parâmetros da consulta)
+response_cache = TTLCache(ttl=settings.RESPONSE_CACHE_TTL_SECONDS, max_size=settings.RESPONSE_CACHE_MAX_SIZE)
+
+# Usuários autenticados, indexados pelo "sub" do token (nome de usuário); qualquer alteração
+# de usuário, em qualquer worker, descarta as entradas
+user_cache = TTLCache(
+    ttl=settings.USER_CACHE_TTL_SECONDS,
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    generation=lambda: catalog_versions.get("users"),
+)
+
+# Verificações de senha bem-sucedidas, indexadas por um HMAC de (hash, senha)
+password_cache = TTLCache(ttl=settings.PASSWORD_CACHE_TTL_SECONDS, max_size=256)
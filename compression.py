@@ -0,0 +1,143 @@
+"""
+Compressão das respostas (gzip, ou brotli quando o pacote `brotli` está instalado).
+
+CompressionMiddleware comprime JSON, HTML e demais textos a partir de COMPRESSION_MIN_SIZE
+bytes, conforme o Accept-Encoding do cliente. Respostas já comprimidas (como as páginas
+pré-renderizadas de pages.py), streams de eventos e arquivos binários passam intactos;
+respostas em streaming são comprimidas pedaço a pedaço, sem bufferização.
+"""
+import gzip
+import zlib
+
+from config import settings
+
+try:
+    import brotli
+except ImportError:  # Opcional: sem o pacote, só gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/html", b"text/plain", b"text/css", b"application/javascript")
+
+
+def available_encodings() -> tuple[str, ...]:
+    """Codificações suportadas, na ordem de preferência."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str, available=None) -> str | None:
+    """Primeira codificação de `available` aceita pelo cliente (q > 0), ou None."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    for encoding in available or available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, level: int | None = None) -> bytes:
+    """Comprime de uma vez (usado também para pré-comprimir as páginas no nível máximo)."""
+    if encoding == "br":
+        return brotli.compress(data, quality=settings.BROTLI_QUALITY if level is None else level)
+    return gzip.compress(data, compresslevel=settings.GZIP_LEVEL if level is None else level, mtime=0)
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+            self._process, self._flush = self._compressor.process, self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._process = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def chunk(self, data: bytes) -> bytes:
+        # Cada pedaço é enviado logo (flush), para não atrasar respostas em streaming
+        return self._process(data) + self._flush()
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+class CompressionMiddleware:
+    """Middleware ASGI puro, como metrics.MetricsMiddleware, para não bufferizar os streams."""
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), "")
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor: StreamCompressor | None = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = next((v for n, v in headers if n == b"content-type"), b"")
+                if (
+                    message["status"] in (204, 304)
+                    or any(n == b"content-encoding" for n, _ in headers)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    await send(message)
+                    return
+                # A decisão depende do tamanho: espera o primeiro pedaço do corpo
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    headers = [(n, v) for n, v in start["headers"]] + [(b"vary", b"Accept-Encoding")]
+                    await send({**start, "headers": headers})
+                    start = None
+                    await send(message)
+                    return
+                compressor = StreamCompressor(encoding)
+                headers = [
+                    (n, weak_etag(v) if n == b"etag" else v)
+                    for n, v in start["headers"] if n != b"content-length"
+                ]
+                headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+                if not more_body:
+                    compressed = compress(body, encoding)
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send({**start, "headers": headers})
+            data = compressor.chunk(body) if more_body else compressor.chunk(body) + compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def weak_etag(value: bytes) -> bytes:
+    """O corpo comprimido difere byte a byte do original: a ETag forte vira fraca."""
+    return value if value.startswith(b"W/") else b"W/" + value
@@ -1,3 +1,4 @@
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -12,9 +13,100 @@ class Settings(BaseSettings):
 
     DATABASE_URL: str
 
+    # Pool de conexões (pool_size/max_overflow/pool_timeout não se aplicam ao SQLite)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+
+    # Camada assíncrona (AsyncSession) para as rotas de leitura. Sem ASYNC_DATABASE_URL,
+    # o endereço é derivado de DATABASE_URL (asyncpg para PostgreSQL, aiosqlite para SQLite)
+    USE_ASYNC_DB: bool = False
+    ASYNC_DATABASE_URL: str | None = None
+
+    # Métricas (/metrics): consultas acima deste tempo vão para o log "estoque.slow_query"
+    # (0 desativa). O endpoint aceita "Authorization: Bearer <METRICS_TOKEN>" ou o token de um
+    # administrador; METRICS_PUBLIC=true libera o acesso sem autenticação
+    SLOW_QUERY_SECONDS: float = 0.5
+    METRICS_TOKEN: str | None = None
+    METRICS_PUBLIC: bool = False
+
+    # Processos da aplicação (o uvicorn lê a mesma variável como padrão de --workers). Com mais
+    # de um, os workers se coordenam pela pasta COORDINATION_DIR (ver coordination.py); sem ela,
+    # é usada uma pasta temporária derivada de DATABASE_URL
+    WEB_CONCURRENCY: int = 1
+    COORDINATION_DIR: str | None = None
+
     ADMIN_DEFAULT_USERNAME: str
     ADMIN_DEFAULT_PASSWORD: str
 
+    # Quantidade de itens resolvidos/atualizados por instrução na importação via planilha
+    IMPORT_CHUNK_SIZE: int = 500
+    # Linhas lidas do banco por lote (cursor do lado do servidor) nas exportações
+    EXPORT_BATCH_SIZE: int = 1000
+    # Por quanto tempo uma Idempotency-Key de movimentação continua válida
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+    # Intervalo entre as fotografias do estoque usadas nas consultas históricas (?as_of=)
+    STOCK_SNAPSHOT_INTERVAL_HOURS: int = 24
+    # Fotografias mais antigas que isto são removidas (a mais recente sempre fica; 0 = manter
+    # todas). Consultas ?as_of= anteriores à fotografia mais antiga deixam de ser respondidas
+    STOCK_SNAPSHOT_RETENTION_DAYS: int = 365
+    # Feed de alterações (/stock/events): eventos guardados para retomada, fila máxima por cliente
+    # e intervalo dos comentários de keep-alive
+    STOCK_FEED_REPLAY_SIZE: int = 1000
+    STOCK_FEED_MAX_PENDING: int = 500
+    STOCK_FEED_KEEPALIVE_SECONDS: int = 15
+
+    # Cache dos usuários autenticados (evita consultar a tabela users a cada requisição)
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_SIZE: int = 1024
+
+    # Respostas serializadas das listagens (/stock/, /public/users, /userslist), por versão do catálogo
+    RESPONSE_CACHE_TTL_SECONDS: int = 300
+    RESPONSE_CACHE_MAX_SIZE: int = 256
+
+    # Login: pool de verificação de senha (0 = um worker por núcleo, divididos entre os
+    # processos de WEB_CONCURRENCY), fila máxima, limite de tentativas por usuário (contado
+    # em cada processo) e cache de verificações bem-sucedidas (0 desativa)
+    LOGIN_WORKERS: int = 0
+    LOGIN_MAX_PENDING: int = 64
+    LOGIN_RATE_LIMIT: int = 10
+    LOGIN_RATE_WINDOW_SECONDS: int = 60
+    PASSWORD_CACHE_TTL_SECONDS: int = 300
+
+    # Logs de atividade: "transactional" (mesmo commit da alteração) ou "batched" (fila + gravação em lote)
+    AUDIT_MODE: Literal["transactional", "batched"] = "transactional"
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_QUEUE_SIZE: int = 10000
+
+    # Retenção dos logs: os mais antigos que LOG_RETENTION_DAYS (0 = manter tudo na tabela) vão
+    # para arquivos CSV gzip em LOG_ARCHIVE_DIR, em blocos de até LOG_ARCHIVE_CHUNK_ROWS linhas
+    LOG_RETENTION_DAYS: int = 0
+    LOG_ARCHIVE_DIR: str = "log_archive"
+    LOG_ARCHIVE_CHUNK_ROWS: int = 50000
+    LOG_ARCHIVE_INTERVAL_HOURS: int = 24
+
+    # Tarefas em segundo plano (importação/exportação com ?background=true): threads do pool,
+    # pasta das planilhas enviadas e dos arquivos gerados, tentativas após reinícios,
+    # linhas com problema guardadas por tarefa e prazo até a limpeza das tarefas concluídas
+    JOB_WORKERS: int = 2
+    JOB_DIR: str = "job_files"
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_MAX_ERRORS: int = 1000
+    JOB_RETENTION_HOURS: int = 24
+
+    # Análise de consumo (GET /stock/analytics): dias de saídas mantidos em memória por
+    # processo (também o maior período aceito pelas consultas)
+    ANALYTICS_HISTORY_DAYS: int = 365
+
+    # Compressão das respostas JSON/HTML a partir deste tamanho (bytes); brotli só com o
+    # pacote `brotli` instalado
+    COMPRESSION_MIN_SIZE: int = 1024
+    GZIP_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4
+
     model_config = SettingsConfigDict(env_file=".env", extra='ignore')
 
 settings = Settings()
@@ -0,0 +1,343 @@
+"""
+Coordenação entre os processos da aplicação (uvicorn --workers / WEB_CONCURRENCY > 1).
+
+Tudo fica numa pasta local (COORDINATION_DIR; por padrão uma pasta temporária derivada
+de DATABASE_URL, para que só os processos do mesmo banco se enxerguem):
+
+- counters: contadores de geração num arquivo mapeado em memória (mmap). As versões dos
+  catálogos (cache.catalog_versions) ficam aqui, então um commit em qualquer worker
+  invalida as listagens e os usuários em cache de todos; a leitura é um acesso à memória.
+- startup.lock: a verificação do esquema e a criação do administrador rodam um worker
+  por vez; os seguintes encontram o esquema em dia e não refazem nada.
+- leader.lock: um único worker (o líder) roda os serviços de segundo plano (fotografias,
+  arquivamento de logs, tarefas, limpezas). Os demais tentam assumir a liderança a cada
+  LEADER_RETRY_SECONDS, para o caso de o líder morrer.
+- peers: sockets Unix de datagrama, um por worker, por onde os eventos do feed de estoque
+  são repassados aos outros workers.
+
+Sem fcntl (Windows), só há um worker: os contadores ficam na memória do processo, ele é
+sempre o líder e não há repasse entre workers.
+"""
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import uuid
+from typing import Callable
+
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, a coordenação fica dentro do processo
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LEADER_RETRY_SECONDS = 5.0
+# Tempo máximo de espera para entregar um datagrama a um worker com a fila cheia
+PEER_SEND_TIMEOUT_SECONDS = 0.2
+PEER_MAX_DATAGRAM = 64 * 1024
+
+EPOCH_SIZE = 16
+COUNTER = struct.Struct("<Q")
+COUNTER_NAMES = ["stock", "users", "jobs"]
+
+
+def default_directory() -> str:
+    digest = hashlib.sha1(settings.DATABASE_URL.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"estoque-{digest}")
+
+
+class SharedCounters:
+    """
+    Contadores inteiros com nome, compartilhados entre processos por um arquivo mapeado em
+    memória, mais um `epoch` (texto curto) renovado a cada troca de líder. O incremento é
+    serializado com flock (entre processos) e um Lock (entre as threads deste processo).
+    """
+
+    def __init__(self, path: str, names: list[str]):
+        self.path = path
+        self._offsets = {name: EPOCH_SIZE + i * COUNTER.size for i, name in enumerate(names)}
+        size = EPOCH_SIZE + len(names) * COUNTER.size
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = os.getpid()
+        with self._locked():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, uuid.uuid4().hex[:EPOCH_SIZE].encode(), 0)
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Processo filho (fork depois da importação): o flock vale por descritor aberto,
+                # então o descritor herdado do pai não exclui o pai
+                self._fd = os.open(self.path, os.O_RDWR)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def epoch(self) -> str:
+        return self._map[:EPOCH_SIZE].decode()
+
+    def renew_epoch(self):
+        with self._locked():
+            self._map[:EPOCH_SIZE] = uuid.uuid4().hex[:EPOCH_SIZE].encode()
+
+    def get(self, name: str) -> int:
+        # Os valores só crescem e a escrita é de 8 bytes alinhados: a leitura dispensa o lock
+        return COUNTER.unpack_from(self._map, self._offsets[name])[0]
+
+    def bump(self, name: str) -> int:
+        with self._locked():
+            value = COUNTER.unpack_from(self._map, self._offsets[name])[0] + 1
+            COUNTER.pack_into(self._map, self._offsets[name], value)
+            return value
+
+    def snapshot(self) -> dict:
+        return {name: self.get(name) for name in self._offsets}
+
+
+class LocalCounters:
+    """Mesma interface de SharedCounters, na memória do processo (um único worker)."""
+
+    def __init__(self, names: list[str]):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+        self._epoch = uuid.uuid4().hex[:EPOCH_SIZE]
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch
+
+    def renew_epoch(self):
+        self._epoch = uuid.uuid4().hex[:EPOCH_SIZE]
+
+    def get(self, name: str) -> int:
+        return self._values[name]
+
+    def bump(self, name: str) -> int:
+        with self._lock:
+            self._values[name] += 1
+            return self._values[name]
+
+    def snapshot(self) -> dict:
+        return dict(self._values)
+
+
+class Peers:
+    """
+    Repasse de mensagens (JSON) para os outros workers por sockets Unix de datagrama.
+    Cada worker escuta em peer-<pid>.sock; sockets de processos que já morreram são removidos.
+    Sem `directory` (um único worker), não há para quem repassar e nada é aberto.
+    """
+
+    def __init__(self, directory: str | None):
+        self.directory = directory
+        self._sock: socket.socket | None = None
+        self._thread: threading.Thread | None = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"peer-{os.getpid()}.sock")
+
+    @property
+    def active(self) -> bool:
+        return self._sock is not None
+
+    def start(self, on_message: Callable[[object], None]):
+        if self._sock is not None or self.directory is None:
+            return
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._thread = threading.Thread(target=self._receive, args=(self._sock, on_message), name="peers", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._sock is None:
+            return
+        sock, self._sock = self._sock, None
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        # Acorda a thread de recepção com um datagrama vazio
+        with contextlib.suppress(OSError), socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as waker:
+            waker.sendto(b"", sock.getsockname())
+        self._thread.join(5)
+        sock.close()
+
+    def _receive(self, sock: socket.socket, on_message):
+        while self._sock is sock:
+            try:
+                data = sock.recv(PEER_MAX_DATAGRAM)
+            except OSError:
+                return
+            if not data:
+                continue
+            self.received += 1
+            try:
+                on_message(json.loads(data))
+            except Exception:
+                logger.exception("Falha ao processar mensagem de outro worker")
+
+    def broadcast(self, message) -> int:
+        """Envia a mensagem aos outros workers. Devolve para quantos foi entregue."""
+        if self._sock is None:
+            return 0
+        data = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+        if len(data) > PEER_MAX_DATAGRAM:
+            raise ValueError("Mensagem grande demais para um datagrama")
+        own = self.path
+        delivered = 0
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.settimeout(PEER_SEND_TIMEOUT_SECONDS)
+            for path in glob.glob(os.path.join(self.directory, "peer-*.sock")):
+                if path == own:
+                    continue
+                try:
+                    sender.sendto(data, path)
+                    delivered += 1
+                except ConnectionRefusedError:
+                    # Ninguém escuta: o worker morreu sem remover o socket
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except (socket.timeout, BlockingIOError):
+                    self.dropped += 1
+                    logger.warning("Worker %s não recebeu uma mensagem (fila cheia)", path)
+        self.sent += delivered
+        return delivered
+
+    def count(self) -> int:
+        if self.directory is None:
+            return 1
+        return len(glob.glob(os.path.join(self.directory, "peer-*.sock")))
+
+
+class Coordinator:
+    def __init__(self, directory: str | None):
+        """Sem `directory`, tudo fica dentro deste processo (um único worker, sem flock)."""
+        self.directory = directory
+        if directory is None:
+            self.counters = LocalCounters(COUNTER_NAMES)
+        else:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            self.counters = SharedCounters(os.path.join(directory, "counters"), COUNTER_NAMES)
+        self.peers = Peers(directory)
+        self._leader = False
+        self._leader_fd: int | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @contextlib.contextmanager
+    def startup_lock(self):
+        """Serializa a partida entre os workers (um de cada vez verifica o esquema)."""
+        if self.directory is None:
+            yield
+            return
+        fd = os.open(os.path.join(self.directory, "startup.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader
+
+    def _try_lead(self) -> bool:
+        if self.directory is None:
+            self._leader = True
+            self.counters.renew_epoch()
+            return True
+        fd = os.open(os.path.join(self.directory, "leader.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._leader, self._leader_fd = True, fd
+        # ETags emitidas antes da troca de líder deixam de valer (ver cache.CatalogVersions)
+        self.counters.renew_epoch()
+        return True
+
+    def elect(self, on_elected: Callable[[], None]):
+        """
+        Assume a liderança, se estiver livre (ou já for deste processo, quando a partida
+        tenta de novo), e chama `on_elected` nesta thread; senão continua tentando em
+        segundo plano e chama `on_elected` quando conseguir.
+        """
+        self._stop.clear()
+        if self.is_leader or self._try_lead():
+            on_elected()
+            return
+
+        def follow():
+            while not self._stop.wait(LEADER_RETRY_SECONDS):
+                if self._try_lead():
+                    logger.info("Worker %s assumiu os serviços de segundo plano", os.getpid())
+                    try:
+                        on_elected()
+                    except Exception:
+                        logger.exception("Falha ao iniciar os serviços de segundo plano")
+                    return
+
+        thread = threading.Thread(target=follow, name="leader-election", daemon=True)
+        thread.start()
+        self._thread = thread
+
+    def stop_following(self):
+        """Para de tentar assumir a liderança (e espera um `on_elected` em andamento)."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(LEADER_RETRY_SECONDS + 1)
+
+    def resign(self):
+        self.stop_following()
+        if self._leader_fd is not None:
+            os.close(self._leader_fd)
+            self._leader_fd = None
+        self._leader = False
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "leader": self.is_leader,
+            "workers": self.peers.count(),
+            "counters": self.counters.snapshot(),
+            "messages": {"sent": self.peers.sent, "received": self.peers.received, "dropped": self.peers.dropped},
+        }
+
+
+def build_coordinator() -> Coordinator:
+    if fcntl is None:
+        if settings.WEB_CONCURRENCY > 1:
+            raise RuntimeError("WEB_CONCURRENCY > 1 exige fcntl (Linux/macOS) para coordenar os workers")
+        return Coordinator(None)
+    return Coordinator(settings.COORDINATION_DIR or default_directory())
+
+
+coordinator = build_coordinator()
@@ -1,17 +1,61 @@
+from sqlalchemy import DateTime, case, delete, event, false, func, insert, literal, select, text, tuple_, union_all, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import re
 from jose import JWTError, jwt
-import models, schemas
+import models, schemas, stock_import, stock_search
+from stock_feed import changes_from_ledger, stock_feed
+from audit import audit_writer
+from cache import catalog_versions, password_cache, user_cache
 from config import settings 
 
+class InsufficientStockError(Exception):
+    """A quantidade de saída é maior que o estoque atual do item."""
+
+class StockConflictError(Exception):
+    """O estoque de algum item mudou entre a validação e a aplicação de um lote."""
+
+class NoStockHistoryError(Exception):
+    """Não há fotografia do estoque anterior à data pedida."""
+
+class IdempotencyKeyConflict(Exception):
+    """A Idempotency-Key já foi usada com uma requisição diferente ou ainda está em processamento."""
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+def mark_catalog_changed(db: Session, catalog: str):
+    """Marca o catálogo ("stock" ou "users") como alterado; a versão só avança no commit da sessão."""
+    db.info.setdefault("changed_catalogs", set()).add(catalog)
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_changes(session):
+    for catalog in session.info.pop("changed_catalogs", ()):
+        catalog_versions.bump(catalog)
+    stock_feed.publish(changes_from_ledger(session.info.pop("stock_changes", [])))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_uncommitted_changes(session):
+    session.info.pop("changed_catalogs", None)
+    session.info.pop("stock_changes", None)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica se a senha fornecida corresponde à senha criptografada."""
-    return pwd_context.verify(plain_password, hashed_password)
+    """
+    Verifica se a senha fornecida corresponde à senha criptografada.
+    Acertos recentes ficam em cache (por um HMAC, nunca a senha em si) para evitar repetir o bcrypt.
+    """
+    key = hmac.new(settings.SECRET_KEY.encode(), f"{hashed_password}\0{plain_password}".encode(), hashlib.sha256).hexdigest()
+    if password_cache.get(key):
+        return True
+    verified = pwd_context.verify(plain_password, hashed_password)
+    if verified:
+        password_cache.set(key, True)
+    return verified
 
 def get_password_hash(password: str) -> str:
     """Gera o hash de uma senha."""
@@ -56,8 +100,11 @@ def get_user_by_username(db: Session, username: str):
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate, password: str | None = None):
-    """Cria um novo utilizador, com senha opcional."""
+def create_user(db: Session, user: schemas.UserCreate, password: str | None = None, commit: bool = True):
+    """
+    Cria um novo utilizador, com senha opcional.
+    Com commit=False a alteração só é enviada ao banco (flush); o commit fica para create_log_entry.
+    """
     hashed_password = get_password_hash(password) if password else None
     db_user = models.User(
         username=user.username,
@@ -65,8 +112,13 @@ def create_user(db: Session, user: schemas.UserCreate, password: str | None = No
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    mark_catalog_changed(db, "users")
+    if commit:
+        db.commit()
+        db.refresh(db_user)
+    else:
+        db.flush()
+    user_cache.invalidate(db_user.username)
     return db_user
     
 def create_admin_if_not_exists(db: Session):
@@ -77,11 +129,16 @@ def create_admin_if_not_exists(db: Session):
         create_user(db, user=admin_schema, password=settings.ADMIN_DEFAULT_PASSWORD)
         print(f"Utilizador '{settings.ADMIN_DEFAULT_USERNAME}' criado com sucesso.")
 
-def delete_user(db: Session, user_id: int):
+def delete_user(db: Session, user_id: int, commit: bool = True):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if db_user:
         db.delete(db_user)
-        db.commit()
+        mark_catalog_changed(db, "users")
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+        user_cache.invalidate(db_user.username)
     return db_user
 
 
@@ -90,9 +147,42 @@ def get_stock_item_by_name(db: Session, name: str):
     return db.query(models.StockItem).filter(models.StockItem.name.ilike(name)).first()
 
 def get_stock_items(db: Session, search: str = ""):
-    return db.query(models.StockItem).filter(models.StockItem.name.ilike(f"%{search}%")).all()
+    return stock_search.filter_stock_items(db.query(models.StockItem), search).all()
+
+def stock_items_page_query(search: str = "", limit: int = 100, after_id: int | None = None, offset: int = 0):
+    """
+    Consulta de uma página da listagem de estoque (limit + 1 linhas, para saber se há mais).
+    - Sem busca: paginação por chave, em ordem de ID, a partir de `after_id`.
+    - Com busca: os resultados seguem a ordem de relevância e a página é definida por `offset`
+      (o conjunto de resultados de uma busca é pequeno e a relevância não serve de chave).
+    """
+    stmt = select(models.StockItem)
+    if search.strip():
+        stmt = stock_search.filter_stock_items(stmt, search).order_by(models.StockItem.id).offset(offset)
+    else:
+        if after_id is not None:
+            stmt = stmt.where(models.StockItem.id > after_id)
+        stmt = stmt.order_by(models.StockItem.id)
+    return stmt.limit(limit + 1)
+
+def get_stock_items_page(db: Session, search: str = "", limit: int = 100, after_id: int | None = None, offset: int = 0):
+    """Uma página da listagem de estoque (ver stock_items_page_query). Retorna (itens, há_mais_páginas)."""
+    items = db.scalars(stock_items_page_query(search, limit, after_id, offset)).all()
+    return items[:limit], len(items) > limit
 
-def create_stock_item(db: Session, item: schemas.StockItemCreate, user_id: int, username: str):
+def iter_stock_items(db: Session, search: str = "", batch_size: int | None = None):
+    """
+    Percorre os itens (id, nome, quantidade, criador) em lotes com cursor do lado do servidor,
+    para exportações que não devem carregar o inventário inteiro em memória.
+    """
+    stmt = (
+        select(models.StockItem.id, models.StockItem.name, models.StockItem.quantity, models.StockItem.created_by_username)
+        .execution_options(yield_per=batch_size or settings.EXPORT_BATCH_SIZE)
+    )
+    stmt = stock_search.filter_stock_items(stmt, search).order_by(models.StockItem.id)
+    return db.execute(stmt)
+
+def create_stock_item(db: Session, item: schemas.StockItemCreate, user_id: int, username: str, commit: bool = True):
     db_item = models.StockItem(
         name=item.name,
         quantity=0,
@@ -100,27 +190,634 @@ def create_stock_item(db: Session, item: schemas.StockItemCreate, user_id: int,
         created_by_username=username
     )
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    db.flush()
+    record_stock_movements(db, [
+        {"item_id": db_item.id, "item_name": db_item.name, "kind": "criacao", "delta": 0, "balance": 0, "username": username}
+    ])
+    if commit:
+        db.commit()
+        db.refresh(db_item)
     return db_item
 
-def delete_stock_item(db: Session, item_id: int):
+def delete_stock_item(db: Session, item_id: int, username: str | None = None, commit: bool = True):
     db_item = db.query(models.StockItem).filter(models.StockItem.id == item_id).first()
     if db_item:
+        record_stock_movements(db, [
+            {"item_id": db_item.id, "item_name": db_item.name, "kind": "exclusao",
+             "delta": -db_item.quantity, "balance": 0, "username": username}
+        ])
         db.delete(db_item)
-        db.commit()
+        if commit:
+            db.commit()
+        else:
+            db.flush()
     return db_item
     
 def get_stock_item_by_id(db: Session, item_id: int):
     return db.query(models.StockItem).filter(models.StockItem.id == item_id).first()
+
+def move_stock_item(
+    db: Session,
+    item_id: int,
+    movement_type: str,
+    quantity: int,
+    username: str,
+    idempotency_key: str | None = None,
+):
+    """
+    Aplica uma entrada ou saída como um único UPDATE condicional e atômico
+    (quantity = quantity +/- n, com "quantity >= n" na saída). O próprio UPDATE bloqueia a
+    linha, então movimentações concorrentes sobre o mesmo item não perdem atualizações.
+
+    Com `idempotency_key`, a chave é reservada na mesma transação da movimentação e a resposta
+    fica guardada: um reenvio com a mesma chave devolve a resposta original sem movimentar de novo.
+    Passado IDEMPOTENCY_KEY_TTL_HOURS, a chave vale como nova, mesmo que ainda não tenha sido removida.
+    O log da movimentação é gravado por create_log_entry, que também faz o commit.
+
+    Retorna (item, reenvio), onde `item` é um dict no formato de schemas.StockItem, ou
+    (None, False) se o item não existe. Lança InsufficientStockError ou IdempotencyKeyConflict.
+    """
+    fingerprint = f"{item_id}:{movement_type}:{quantity}"
+    record = None
+    if idempotency_key:
+        record = models.IdempotencyKey(key=idempotency_key, username=username, fingerprint=fingerprint)
+        db.add(record)
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            previous = db.get(models.IdempotencyKey, (idempotency_key, username))
+            if previous is not None and not _idempotency_key_expired(previous):
+                # Chave já usada: devolve a resposta guardada do pedido original
+                if previous.fingerprint != fingerprint or previous.response is None:
+                    raise IdempotencyKeyConflict()
+                return previous.response, True
+            # Chave vencida (ou removida nesse meio tempo): a reserva é refeita
+            if previous is not None:
+                db.delete(previous)
+                db.flush()
+            record = models.IdempotencyKey(key=idempotency_key, username=username, fingerprint=fingerprint)
+            db.add(record)
+            try:
+                db.flush()
+            except IntegrityError:
+                # Outro pedido reservou a mesma chave ao mesmo tempo
+                db.rollback()
+                raise IdempotencyKeyConflict()
+
+    item = models.StockItem
+    stmt = update(item).where(item.id == item_id)
+    if movement_type == "entrada":
+        stmt = stmt.values(quantity=item.quantity + quantity)
+    else:
+        stmt = stmt.where(item.quantity >= quantity).values(quantity=item.quantity - quantity)
+    stmt = stmt.returning(item.id, item.name, item.quantity, item.created_by_username)
+    row = db.execute(stmt.execution_options(synchronize_session=False)).first()
+
+    if row is None:
+        exists = db.scalar(select(item.id).where(item.id == item_id))
+        db.rollback()
+        if exists:
+            raise InsufficientStockError()
+        return None, False
+
+    result = dict(row._mapping)
+    if record is not None:
+        record.response = result
+    record_stock_movements(db, [{
+        "item_id": item_id, "item_name": result["name"], "kind": movement_type,
+        "delta": quantity if movement_type == "entrada" else -quantity,
+        "balance": result["quantity"], "username": username,
+    }])
+    action = f"Deu {movement_type} de {quantity} unidades no item '{result['name']}' (Estoque atual: {result['quantity']})"
+    create_log_entry(db, username=username, action=action)
+    return result, False
+
+def apply_stock_movements_batch(db: Session, lines: list[schemas.StockMovementLine], username: str, all_or_nothing: bool = True):
+    """
+    Aplica um lote de movimentações numa única transação.
+
+    1. Lê (e bloqueia, no PostgreSQL) todos os itens envolvidos com uma consulta;
+    2. valida as linhas em ordem, acumulando o estoque de cada item, e marca as que falham;
+    3. aplica o saldo de cada item com um único UPDATE (CASE por ID), condicionado ao estoque
+       mínimo que a sequência de movimentações exige;
+    4. grava os logs de todas as linhas aplicadas com um INSERT de várias linhas.
+
+    No modo tudo-ou-nada, qualquer linha inválida cancela o lote. Retorna (confirmado, resultados),
+    com um resultado por linha. Lança StockConflictError se o estoque mudar durante a operação.
+    """
+    item = models.StockItem
+    ids = sorted({line.item_id for line in lines})
+    rows = db.execute(
+        select(item.id, item.name, item.quantity).where(item.id.in_(ids)).order_by(item.id).with_for_update()
+    ).all()
+    names = {row.id: row.name for row in rows}
+    running = {row.id: row.quantity for row in rows}
+    delta = dict.fromkeys(running, 0)
+    # Menor saldo acumulado de cada item ao longo do lote; o estoque inicial precisa cobri-lo
+    lowest = dict.fromkeys(running, 0)
+
+    results = []
+    for number, line in enumerate(lines, start=1):
+        result = {"line": number, "item_id": line.item_id, "status": "applied"}
+        change = line.quantity if line.type == "entrada" else -line.quantity
+        if line.item_id not in running:
+            result.update(status="not_found", detail="Item não encontrado.")
+        elif running[line.item_id] + change < 0:
+            result.update(status="insufficient", detail="A quantidade de saída não pode ser maior que o estoque atual.")
+        else:
+            running[line.item_id] += change
+            delta[line.item_id] += change
+            lowest[line.item_id] = min(lowest[line.item_id], delta[line.item_id])
+            result["quantity"] = running[line.item_id]
+        results.append(result)
+
+    failed = [r for r in results if r["status"] != "applied"]
+    applied = [(r, line) for r, line in zip(results, lines) if r["status"] == "applied"]
+    if (failed and all_or_nothing) or not applied:
+        db.rollback()
+        if all_or_nothing:
+            for r in results:
+                if r["status"] == "applied":
+                    r.update(status="skipped", quantity=None, detail="Lote cancelado por erro em outra linha.")
+        return False, results
+
+    touched = sorted({line.item_id for _, line in applied})
+    returned = db.execute(
+        update(item)
+        .where(item.id.in_(touched))
+        .where(item.quantity >= case({i: -lowest[i] for i in touched}, value=item.id))
+        .values(quantity=item.quantity + case({i: delta[i] for i in touched}, value=item.id))
+        .returning(item.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if len(returned) != len(touched):
+        db.rollback()
+        raise StockConflictError()
+
+    record_stock_movements(db, [
+        {
+            "item_id": line.item_id, "item_name": names[line.item_id], "kind": line.type,
+            "delta": line.quantity if line.type == "entrada" else -line.quantity,
+            "balance": r["quantity"], "username": username,
+        }
+        for r, line in applied
+    ])
+    create_log_entries(db, username, [
+        f"Deu {line.type} de {line.quantity} unidades no item '{names[line.item_id]}' (Estoque atual: {r['quantity']})"
+        for r, line in applied
+    ])
+    return True, results
+
+def _idempotency_key_expired(record: models.IdempotencyKey) -> bool:
+    created_at = record.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at < datetime.now(timezone.utc) - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+def purge_idempotency_keys(db: Session, older_than: datetime) -> int:
+    """Remove as Idempotency-Keys registradas antes de `older_than`. Devolve quantas foram removidas."""
+    removed = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.created_at < older_than)).rowcount
+    db.commit()
+    return removed
+
+def record_stock_movements(db: Session, rows: list[dict]):
+    """
+    Acrescenta linhas ao razão de movimentações (item_id, item_name, kind, delta, balance, username).
+    Não faz commit: as linhas entram na mesma transação da alteração do estoque e só
+    chegam ao feed de alterações depois do commit.
+    """
+    now = datetime.now(timezone.utc)
+    db.execute(insert(models.StockLedgerEntry), [{"created_at": now, **row} for row in rows])
+    mark_catalog_changed(db, "stock")
+    # Publicadas no feed (/stock/events) só depois do commit
+    db.info.setdefault("stock_changes", []).extend(rows)
+
+def _block_stock_writes(db: Session):
+    """
+    Impede alterações do estoque até o fim da transação e espera as que estão em andamento.
+    Toda alteração de stock_items grava o razão na mesma transação, então, depois disto, o
+    maior id do razão corresponde exatamente às quantidades lidas.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE stock_items IN SHARE MODE"))
+    else:
+        # No SQLite, a primeira escrita da transação reserva o banco para ela
+        db.execute(delete(models.StockSnapshotRun).where(false()))
+
+def take_stock_snapshot(db: Session):
+    """
+    Grava a quantidade atual de todos os itens numa nova fotografia, com um único INSERT ... SELECT,
+    junto com o maior id do razão refletido nela.
+    """
+    _block_stock_writes(db)
+    taken_at = datetime.now(timezone.utc)
+    ledger_id = db.scalar(select(func.coalesce(func.max(models.StockLedgerEntry.id), 0)))
+    result = db.execute(
+        insert(models.StockSnapshot).from_select(
+            ["taken_at", "item_id", "name", "quantity"],
+            select(literal(taken_at, DateTime(timezone=True)), models.StockItem.id, models.StockItem.name, models.StockItem.quantity),
+        )
+    )
+    db.add(models.StockSnapshotRun(taken_at=taken_at, item_count=max(result.rowcount, 0), ledger_id=ledger_id))
+    db.commit()
+    return taken_at
+
+def get_latest_snapshot_time(db: Session, before: datetime | None = None):
+    stmt = select(func.max(models.StockSnapshotRun.taken_at))
+    if before is not None:
+        stmt = stmt.where(models.StockSnapshotRun.taken_at <= before)
+    return db.scalar(stmt)
+
+def get_latest_snapshot_run(db: Session, before: datetime):
+    return db.scalars(
+        select(models.StockSnapshotRun)
+        .where(models.StockSnapshotRun.taken_at <= before)
+        .order_by(models.StockSnapshotRun.taken_at.desc())
+        .limit(1)
+    ).first()
+
+def purge_stock_snapshots(db: Session, older_than: datetime) -> int:
+    """Remove as fotografias anteriores a `older_than`, menos a mais recente. Devolve quantas foram removidas."""
+    latest = get_latest_snapshot_time(db)
+    if latest is None:
+        return 0
+    if latest.tzinfo is None:
+        latest = latest.replace(tzinfo=timezone.utc)
+    cutoff = min(older_than, latest)
+    db.execute(delete(models.StockSnapshot).where(models.StockSnapshot.taken_at < cutoff))
+    removed = db.execute(delete(models.StockSnapshotRun).where(models.StockSnapshotRun.taken_at < cutoff)).rowcount
+    db.commit()
+    return removed
+
+def get_stock_history_page(db: Session, item_id: int, limit: int = 100, before: tuple[datetime, int] | None = None, as_of: datetime | None = None):
+    """Movimentações de um item, da mais recente à mais antiga, com paginação por (created_at, id)."""
+    entry = models.StockLedgerEntry
+    stmt = select(entry).where(entry.item_id == item_id)
+    if as_of is not None:
+        stmt = stmt.where(entry.created_at <= as_of)
+    if before:
+        stmt = stmt.where(tuple_(entry.created_at, entry.id) < tuple_(*before))
+    entries = db.scalars(stmt.order_by(entry.created_at.desc(), entry.id.desc()).limit(limit + 1)).all()
+    return entries[:limit], len(entries) > limit
+
+# Textos dos logs de atividade gravados antes do razão (ver backfill_stock_ledger)
+MOVEMENT_LOG = re.compile(r"Deu (entrada|saida) de (\d+) unidades no item '(.*)' \(Estoque atual: (\d+)\)", re.S)
+CREATION_LOG = re.compile(r"Criou o item de inventário '(.*)'", re.S)
+DELETION_LOG = re.compile(r"Excluiu o item de inventário '(.*)'", re.S)
+
+def backfill_stock_ledger(db: Session, batch_size: int = 1000) -> int:
+    """
+    Reconstrói no razão as criações, entradas e saídas registradas só nos logs de atividade,
+    de antes de o razão existir (logs anteriores à primeira linha gravada pela aplicação).
+    Os logs trazem o nome do item, não o ID: vale o item atual com o mesmo nome, e os logs
+    de um item excluído depois (mesmo que o nome tenha sido reaproveitado) ficam de fora.
+    Cada linha guarda o id do log de origem, então rodar de novo não duplica nada.
+    Devolve quantas linhas foram acrescentadas.
+    """
+    entry, log = models.StockLedgerEntry, models.LogEntry
+    boundary = db.scalar(select(func.min(entry.created_at)).where(entry.log_id.is_(None)))
+    done = set(db.scalars(select(entry.log_id).where(entry.log_id.is_not(None))))
+    items = dict(db.execute(select(models.StockItem.name, models.StockItem.id)).all())
+    deleted_at: dict[str, datetime] = {}
+    for timestamp, action in db.execute(
+        select(log.timestamp, log.action).where(log.action.like("Excluiu o item de inventário %"))
+    ):
+        match = DELETION_LOG.fullmatch(action)
+        if match and (match[1] not in deleted_at or timestamp > deleted_at[match[1]]):
+            deleted_at[match[1]] = timestamp
+
+    stmt = select(log.id, log.timestamp, log.action, log.username).where(
+        log.action.like("Deu %") | log.action.like("Criou o item de inventário %")
+    )
+    if boundary is not None:
+        stmt = stmt.where(log.timestamp < boundary)
+    rows = []
+    added = 0
+    # Lido por outra conexão: no SQLite, gravar na mesma conexão durante a leitura é recusado
+    with db.get_bind().connect() as reader:
+        for log_id, timestamp, action, username in reader.execute(stmt.order_by(log.id).execution_options(yield_per=batch_size)):
+            if log_id in done:
+                continue
+            match = MOVEMENT_LOG.fullmatch(action)
+            if match:
+                kind, quantity, name, balance = match[1], int(match[2]), match[3], int(match[4])
+                delta = quantity if kind == "entrada" else -quantity
+            else:
+                match = CREATION_LOG.fullmatch(action)
+                if not match:
+                    continue
+                kind, name, delta, balance = "criacao", match[1], 0, 0
+            if name not in items or (name in deleted_at and deleted_at[name] > timestamp):
+                continue
+            rows.append({
+                "item_id": items[name], "item_name": name, "kind": kind, "delta": delta,
+                "balance": balance, "username": username, "created_at": timestamp, "log_id": log_id,
+            })
+            if len(rows) >= batch_size:
+                db.execute(insert(entry), rows)
+                added += len(rows)
+                rows = []
+    if rows:
+        db.execute(insert(entry), rows)
+        added += len(rows)
+    db.commit()
+    return added
+
+def _ledger_day(db: Session):
+    """Dia (UTC) de cada linha do razão, no dialeto do banco."""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date(func.timezone("UTC", models.StockLedgerEntry.created_at))
+    # O SQLite guarda o horário em UTC, sem fuso
+    return func.date(models.StockLedgerEntry.created_at)
+
+def get_daily_consumption(db: Session, since: datetime, until: datetime | None = None):
+    """
+    Saídas do razão somadas por item e dia (UTC) entre `since` e `until` (exclusivo):
+    linhas (item_id, day, consumed), com o dia em texto AAAA-MM-DD (SQLite) ou date.
+    """
+    entry = models.StockLedgerEntry
+    day = _ledger_day(db)
+    stmt = select(entry.item_id, day.label("day"), func.sum(-entry.delta).label("consumed")).where(
+        entry.kind == "saida", entry.created_at >= since,
+    )
+    if until is not None:
+        stmt = stmt.where(entry.created_at < until)
+    return db.execute(stmt.group_by(entry.item_id, day)).all()
+
+def get_first_movement_days(db: Session, since: datetime | None = None, until: datetime | None = None):
+    """Dia (UTC) da primeira linha do razão de cada item entre `since` e `until` (exclusivo): linhas (item_id, day)."""
+    entry = models.StockLedgerEntry
+    stmt = select(entry.item_id, func.min(_ledger_day(db)).label("day"))
+    if since is not None:
+        stmt = stmt.where(entry.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(entry.created_at < until)
+    return db.execute(stmt.group_by(entry.item_id)).all()
+
+def get_stock_levels(db: Session):
+    """Id, nome e quantidade atual de todos os itens."""
+    item = models.StockItem
+    return db.execute(select(item.id, item.name, item.quantity)).all()
+
+def get_stock_as_of_page(db: Session, as_of: datetime, limit: int = 100, after_id: int | None = None):
+    """
+    Estoque de todos os itens em `as_of`: parte da fotografia mais recente anterior à data e
+    aplica só as movimentações entre ela e `as_of` (no máximo um intervalo de fotografias),
+    usando o saldo da última movimentação de cada item. Itens excluídos até a data ficam de fora.
+    Retorna (itens, há_mais_páginas). Lança NoStockHistoryError se não houver fotografia anterior.
+    """
+    run = get_latest_snapshot_run(db, before=as_of)
+    if run is None:
+        raise NoStockHistoryError()
+    snapshot_time = run.taken_at
+
+    entry, snapshot = models.StockLedgerEntry, models.StockSnapshot
+    # Pelo id: uma movimentação com horário anterior à fotografia, mas confirmada depois
+    # dela, não está na fotografia e precisa entrar aqui
+    after_snapshot = entry.id > run.ledger_id if run.ledger_id is not None else entry.created_at > snapshot_time
+    latest = (
+        select(func.max(entry.id).label("id"))
+        # As linhas reconstruídas dos logs são anteriores a qualquer fotografia, mas têm ids novos
+        .where(after_snapshot, entry.log_id.is_(None), entry.created_at <= as_of)
+        .group_by(entry.item_id)
+        .subquery()
+    )
+    moved = select(
+        entry.item_id.label("id"), entry.item_name.label("name"), entry.balance.label("quantity"), entry.kind.label("kind")
+    ).join(latest, entry.id == latest.c.id)
+    unchanged = select(
+        snapshot.item_id.label("id"), snapshot.name, snapshot.quantity, literal("snapshot").label("kind")
+    ).where(
+        snapshot.taken_at == snapshot_time,
+        snapshot.item_id.not_in(select(entry.item_id).where(entry.id.in_(select(latest.c.id)))),
+    )
+    combined = union_all(moved, unchanged).subquery()
+
+    stmt = select(combined.c.id, combined.c.name, combined.c.quantity).where(combined.c.kind != "exclusao")
+    if after_id is not None:
+        stmt = stmt.where(combined.c.id > after_id)
+    rows = db.execute(stmt.order_by(combined.c.id).limit(limit + 1)).all()
+    return [dict(row._mapping) for row in rows[:limit]], len(rows) > limit
+
+def bulk_set_stock_quantities(
+    db: Session,
+    rows: list[tuple[int, int, int]],
+    chunk_size: int | None = None,
+    username: str | None = None,
+    commit: bool = True,
+):
+    """
+    Define a quantidade de vários itens de uma só vez (importação via planilha).
+    Recebe tuplas (linha, item_id, quantidade) e devolve um relatório por linha com o status
+    'updated', 'not_found' ou 'superseded'. Os IDs são resolvidos com uma consulta por lote e
+    as quantidades aplicadas com um UPDATE em massa por lote, tudo numa única transação.
+    Se o mesmo ID aparecer em várias linhas, prevalece a última; as anteriores saem como 'superseded'.
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+
+    # Área de preparação: última quantidade informada para cada ID
+    superseded, rows = stock_import.supersede_repeated_ids(rows)
+    staged = {item_id: quantity for _, item_id, quantity in rows}
+
+    ids = list(staged)
+    found: set[int] = set()
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        existing = db.execute(
+            select(models.StockItem.id, models.StockItem.name, models.StockItem.quantity)
+            .where(models.StockItem.id.in_(chunk))
+        ).all()
+        if not existing:
+            continue
+        found.update(row.id for row in existing)
+        db.execute(
+            update(models.StockItem),
+            [{"id": row.id, "quantity": staged[row.id]} for row in existing],
+        )
+        record_stock_movements(db, [
+            {"item_id": row.id, "item_name": row.name, "kind": "importacao",
+             "delta": staged[row.id] - row.quantity, "balance": staged[row.id], "username": username}
+            for row in existing
+        ])
+    if commit:
+        db.commit()
+
+    return superseded + [
+        {"row": line, "item_id": item_id, "status": "updated" if item_id in found else "not_found"}
+        for line, item_id, _ in rows
+    ]
     
+def create_log_entries(db: Session, username: str, actions: list[str]):
+    """
+    Registra ações no log e faz o commit da sessão, confirmando junto a alteração que as originou.
+    - AUDIT_MODE "transactional": os logs são inseridos (um INSERT de várias linhas) no mesmo commit;
+    - AUDIT_MODE "batched": o commit confirma só a alteração e os logs vão para a fila de gravação em lote.
+    """
+    rows = [{"username": username, "action": action, "timestamp": datetime.now(timezone.utc)} for action in actions]
+    if settings.AUDIT_MODE == "transactional":
+        db.execute(insert(models.LogEntry), rows)
+        db.commit()
+    else:
+        db.commit()
+        audit_writer.submit(rows)
+
 def create_log_entry(db: Session, username: str, action: str):
-    db_log = models.LogEntry(username=username, action=action)
-    db.add(db_log)
-    db.commit()
-    db.refresh(db_log)
-    return db_log
+    create_log_entries(db, username, [action])
 
 def get_log_entries(db: Session, skip: int = 0, limit: int = 200):
     return db.query(models.LogEntry).order_by(models.LogEntry.timestamp.desc()).offset(skip).limit(limit).all()
 
+def log_entries_page_query(
+    limit: int = 200,
+    before: tuple[datetime, int] | None = None,
+    username: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    action: str | None = None,
+):
+    """
+    Consulta de uma página de logs, do mais recente ao mais antigo, com paginação por chave em
+    (timestamp, id). `before` é o (timestamp, id) do último log da página anterior.
+    """
+    stmt = select(models.LogEntry)
+    if username:
+        stmt = stmt.where(models.LogEntry.username == username)
+    if date_from:
+        stmt = stmt.where(models.LogEntry.timestamp >= date_from)
+    if date_to:
+        stmt = stmt.where(models.LogEntry.timestamp <= date_to)
+    if action:
+        stmt = stmt.where(models.LogEntry.action.ilike(f"%{action}%"))
+    if before:
+        stmt = stmt.where(tuple_(models.LogEntry.timestamp, models.LogEntry.id) < tuple_(*before))
+    return stmt.order_by(models.LogEntry.timestamp.desc(), models.LogEntry.id.desc()).limit(limit + 1)
+
+def get_log_entries_page(db: Session, limit: int = 200, **filters):
+    """Uma página de logs (ver log_entries_page_query). Retorna (logs, há_mais_páginas)."""
+    logs = db.scalars(log_entries_page_query(limit, **filters)).all()
+    return logs[:limit], len(logs) > limit
+
+def iter_log_entries(
+    db: Session,
+    batch_size: int | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+):
+    """Percorre o histórico de logs, do mais recente ao mais antigo, em lotes com cursor do lado do servidor."""
+    stmt = select(models.LogEntry.id, models.LogEntry.timestamp, models.LogEntry.username, models.LogEntry.action)
+    if date_from:
+        stmt = stmt.where(models.LogEntry.timestamp >= date_from)
+    if date_to:
+        stmt = stmt.where(models.LogEntry.timestamp <= date_to)
+    stmt = (
+        stmt.order_by(models.LogEntry.timestamp.desc(), models.LogEntry.id.desc())
+        .execution_options(yield_per=batch_size or settings.EXPORT_BATCH_SIZE)
+    )
+    return db.execute(stmt)
+
+def get_archivable_log_entries(db: Session, older_than: datetime, limit: int):
+    """Os `limit` logs mais antigos anteriores a `older_than`, do mais antigo ao mais recente."""
+    stmt = (
+        select(models.LogEntry.id, models.LogEntry.timestamp, models.LogEntry.username, models.LogEntry.action)
+        .where(models.LogEntry.timestamp < older_than)
+        .order_by(models.LogEntry.timestamp, models.LogEntry.id)
+        .limit(limit)
+    )
+    return db.execute(stmt).all()
+
+def delete_log_entries(db: Session, ids: list[int], batch_size: int = 500) -> int:
+    """Remove os logs com os ids informados (um bloco já arquivado). Devolve quantos foram removidos."""
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        result = db.execute(delete(models.LogEntry).where(models.LogEntry.id.in_(ids[start:start + batch_size])))
+        deleted += result.rowcount
+    db.commit()
+    return deleted
+
+
+# --- Tarefas em segundo plano (ver jobs.py) ---
+
+def create_job(db: Session, job_id: str, kind: str, username: str, params: dict):
+    job = models.Job(id=job_id, kind=kind, status="queued", username=username, params=params, processed=0, attempts=0)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_job(db: Session, job_id: str):
+    return db.get(models.Job, job_id)
+
+def get_queued_job_ids(db: Session) -> list[str]:
+    return db.scalars(
+        select(models.Job.id).where(models.Job.status == "queued").order_by(models.Job.created_at)
+    ).all()
+
+def claim_job(db: Session, job_id: str):
+    """
+    Passa a tarefa de "queued" para "running" e conta a tentativa. Devolve a tarefa, ou None
+    se ela já não estava na fila (outra thread a pegou ou ela foi concluída).
+    """
+    result = db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status == "queued")
+        .values(status="running", attempts=models.Job.attempts + 1, started_at=datetime.now(timezone.utc))
+    )
+    db.commit()
+    if result.rowcount != 1:
+        return None
+    return db.get(models.Job, job_id)
+
+def release_job(db: Session, job_id: str):
+    """Devolve à fila uma tarefa interrompida pelo desligamento, sem contar a tentativa."""
+    db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status == "running")
+        .values(status="queued", attempts=models.Job.attempts - 1)
+    )
+    db.commit()
+
+def finish_job(db: Session, job: models.Job, result: dict, file: str | None = None, commit: bool = True):
+    job.status = "succeeded"
+    job.result = result
+    job.file = file
+    job.finished_at = datetime.now(timezone.utc)
+    if commit:
+        db.commit()
+
+def fail_job(db: Session, job_id: str, error: str):
+    db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id)
+        .values(status="failed", error=error, finished_at=datetime.now(timezone.utc))
+    )
+    db.commit()
+
+def requeue_interrupted_jobs(db: Session, max_attempts: int) -> tuple[int, int]:
+    """
+    Tarefas que ficaram "running" porque o processo foi encerrado no meio: voltam para a fila,
+    ou falham se já esgotaram as tentativas. Devolve (devolvidas à fila, marcadas como falha).
+    """
+    now = datetime.now(timezone.utc)
+    failed = db.execute(
+        update(models.Job)
+        .where(models.Job.status == "running", models.Job.attempts >= max_attempts)
+        .values(status="failed", finished_at=now,
+                error=f"Tarefa interrompida {max_attempts} vezes por reinício do servidor.")
+    ).rowcount
+    requeued = db.execute(
+        update(models.Job).where(models.Job.status == "running").values(status="queued")
+    ).rowcount
+    db.commit()
+    return requeued, failed
+
+def purge_finished_jobs(db: Session, older_than: datetime):
+    """Remove as tarefas concluídas antes de `older_than`. Devolve (id, file, params) das removidas, para apagar os arquivos."""
+    rows = db.execute(
+        select(models.Job.id, models.Job.file, models.Job.params)
+        .where(models.Job.status.in_(["succeeded", "failed"]), models.Job.finished_at < older_than)
+    ).all()
+    if rows:
+        db.execute(delete(models.Job).where(models.Job.id.in_([row.id for row in rows])))
+        db.commit()
+    return rows
@@ -0,0 +1,97 @@
+"""
+Geração incremental dos arquivos de exportação (xlsx e CSV).
+As linhas são consumidas de um iterador e escritas à medida que chegam,
+sem montar a tabela inteira em memória.
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime
+from typing import Iterable, Iterator, Sequence
+
+import crud
+from log_archive import log_archiver
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+
+# Tamanho dos blocos enviados ao cliente
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_xlsx(sheet_name: str, header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+    """
+    Escreve as linhas numa planilha em modo write-only do openpyxl (as linhas vão para disco,
+    não ficam em memória) e devolve o arquivo final em blocos.
+    """
+    # Importado só na primeira exportação xlsx, para não pesar na partida
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append(list(header))
+    for row in rows:
+        ws.append(list(row))
+
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while chunk := tmp.read(CHUNK_SIZE):
+            yield chunk
+
+
+def iter_csv(header: Sequence[str], rows: Iterable[Sequence], rows_per_chunk: int = 1000) -> Iterator[bytes]:
+    """
+    Gera o CSV em blocos de `rows_per_chunk` linhas.
+    Usa ';' como separador e BOM UTF-8 para que o Excel em português abra os acentos corretamente.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    buffer.write("\ufeff")
+    writer.writerow(header)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def render(export_format: str, sheet_name: str, header: Sequence[str], rows: Iterable[Sequence]) -> tuple[Iterator[bytes], str, str]:
+    """Gera o arquivo no formato pedido. Devolve (blocos, media type, extensão)."""
+    if export_format == "csv":
+        return iter_csv(header, rows), CSV_MEDIA_TYPE, "csv"
+    return iter_xlsx(sheet_name, header, rows), XLSX_MEDIA_TYPE, "xlsx"
+
+
+# --- Fontes das exportações (usadas pelas rotas e pelas tarefas em segundo plano) ---
+
+STOCK_HEADER = ["ID do Item", "Nome do Item", "Quantidade", "Criado Por"]
+LOG_HEADER = ["ID", "Data e Hora", "Usuário", "Ação Realizada"]
+
+
+def stock_rows(db, search: str = "") -> Iterator[Sequence]:
+    return crud.iter_stock_items(db, search=search)
+
+
+def log_rows(db, date_from: datetime | None = None, date_to: datetime | None = None, include_archived: bool = False) -> Iterator[Sequence]:
+    """Logs da tabela e, com include_archived, também os já arquivados em disco (mais antigos)."""
+    for log in crud.iter_log_entries(db, date_from=date_from, date_to=date_to):
+        yield log.id, log.timestamp.strftime("%Y-%m-%d %H:%M:%S"), log.username, log.action
+    if include_archived:
+        for log_id, timestamp, username, action in log_archiver.iter_archived(date_from, date_to):
+            yield log_id, timestamp.strftime("%Y-%m-%d %H:%M:%S"), username, action
+
+
+# catálogo -> (cabeçalho, função que percorre as linhas com uma sessão)
+SOURCES = {
+    "stock": (STOCK_HEADER, stock_rows),
+    "logs": (LOG_HEADER, log_rows),
+}
@@ -0,0 +1,340 @@
+"""
+Tarefas em segundo plano (tabela jobs): importação de planilhas e exportações.
+
+Com ?background=true, as rotas de importação e exportação só registram a tarefa como
+"queued" (a planilha enviada é gravada em JOB_DIR) e respondem 202 com o id; um pool de
+JOB_WORKERS threads executa as tarefas. GET /jobs/{id} mostra o progresso, as linhas
+com problema e o motivo de uma falha; os arquivos exportados ficam em JOB_DIR para
+download (GET /jobs/{id}/download) até a limpeza, JOB_RETENTION_HOURS depois do fim.
+
+Reinício: a importação aplica as linhas em lotes e grava o progresso no mesmo commit de
+cada lote, então uma tarefa interrompida retoma do último lote confirmado; a exportação
+recomeça do zero. Na partida, as tarefas que ficaram "running" voltam para a fila até
+JOB_MAX_ATTEMPTS tentativas e, depois disso, são marcadas como "failed".
+
+Com vários workers, só o líder (coordination.py) executa as tarefas: os outros gravam a
+tarefa e avançam o contador compartilhado "jobs", que o despachante do líder observa.
+Por isso a retomada na partida é segura: nenhum outro processo executa tarefas.
+
+O progresso das exportações fica só em memória enquanto elas rodam (e só aparece nas
+consultas atendidas pelo líder): as linhas são lidas com cursor do lado do servidor e, no
+SQLite, gravar em outra conexão durante a leitura esperaria o fim do cursor (database is locked).
+"""
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Callable
+
+import crud, exports, models, stock_import
+from config import settings
+from coordination import SharedCounters, coordinator
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo entre duas limpezas de tarefas antigas
+PURGE_INTERVAL = timedelta(hours=1)
+# Intervalo com que o despachante observa o contador "jobs" e, no máximo, entre duas consultas à fila
+DISPATCH_INTERVAL_SECONDS = 0.5
+FULL_POLL_SECONDS = 60.0
+# Linhas exportadas entre duas atualizações do progresso (e verificações de desligamento)
+EXPORT_PROGRESS_ROWS = 1000
+
+
+class JobInterrupted(Exception):
+    """A aplicação está encerrando: a tarefa volta para a fila e continua na próxima partida."""
+
+
+class JobRunner:
+    def __init__(self, session_factory, counters: SharedCounters, directory: str, workers: int,
+                 max_attempts: int, max_errors: int, retention: timedelta):
+        self._session_factory = session_factory
+        self._counters = counters
+        self.directory = directory
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.max_errors = max_errors
+        self.retention = retention
+        self._handlers: dict[str, Callable] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._dispatcher: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # Tarefas entregues ao pool e ainda não concluídas
+        self._submitted: set[str] = set()
+        # id -> linhas processadas das tarefas em execução neste processo
+        self._live: dict[str, int] = {}
+        self._last_purge: datetime | None = None
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def handler(self, kind: str):
+        def register(fn):
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        if self.running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        db = self._session_factory()
+        try:
+            requeued, failed = crud.requeue_interrupted_jobs(db, self.max_attempts)
+        finally:
+            db.close()
+        if requeued or failed:
+            logger.warning("Tarefas interrompidas no último encerramento: %s devolvidas à fila, %s com falha",
+                           requeued, failed)
+        self.requeued += requeued
+        self._dispatcher = threading.Thread(target=self._dispatch, name="job-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self):
+        """Interrompe as tarefas entre dois lotes (elas voltam para a fila) e encerra o pool."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._dispatcher.join(10)
+        self._dispatcher = None
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+    def check_stop(self):
+        if self._stop.is_set():
+            raise JobInterrupted()
+
+    # --- Fila ---
+
+    def enqueue(self, db, kind: str, username: str, params: dict,
+                upload: BinaryIO | None = None, upload_suffix: str = "") -> models.Job:
+        """Registra a tarefa (gravando antes a planilha enviada, se houver) e a entrega ao pool."""
+        job_id = uuid.uuid4().hex
+        if upload is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            params = {**params, "upload": f"{job_id}.upload{upload_suffix}"}
+            with open(self.path(params["upload"]), "wb") as f:
+                shutil.copyfileobj(upload, f)
+        job = crud.create_job(db, job_id, kind, username, params)
+        # Avisa o despachante do líder, esteja ele neste processo ou em outro worker
+        self._counters.bump("jobs")
+        self._wake.set()
+        return job
+
+    def _dispatch(self):
+        """Entrega ao pool as tarefas da fila; consulta o banco quando o contador "jobs" muda."""
+        seen = None
+        last_poll = 0.0
+        while not self._stop.is_set():
+            generation = self._counters.get("jobs")
+            if generation != seen or time.monotonic() - last_poll > FULL_POLL_SECONDS:
+                try:
+                    self._submit_queued()
+                    seen, last_poll = generation, time.monotonic()
+                except Exception:
+                    logger.exception("Falha ao consultar a fila de tarefas")
+            if self._last_purge is None or datetime.now(timezone.utc) - self._last_purge > PURGE_INTERVAL:
+                try:
+                    self.purge()
+                except Exception:
+                    logger.exception("Falha ao limpar as tarefas antigas")
+            self._wake.wait(DISPATCH_INTERVAL_SECONDS)
+            self._wake.clear()
+
+    def _submit_queued(self):
+        db = self._session_factory()
+        try:
+            pending = crud.get_queued_job_ids(db)
+        finally:
+            db.close()
+        for job_id in pending:
+            with self._lock:
+                if job_id in self._submitted:
+                    continue
+                self._submitted.add(job_id)
+            self._executor.submit(self._execute, job_id)
+
+    def report_progress(self, job_id: str, processed: int):
+        self._live[job_id] = processed
+
+    def progress(self, job: models.Job) -> int:
+        """Linhas processadas, incluindo o progresso em memória de uma tarefa em execução aqui."""
+        return max(job.processed or 0, self._live.get(job.id, 0))
+
+    def _execute(self, job_id: str):
+        db = self._session_factory()
+        try:
+            job = crud.claim_job(db, job_id)
+            if job is None:
+                return
+            self._live[job_id] = job.processed or 0
+            try:
+                self._handlers[job.kind](self, db, job)
+            except JobInterrupted:
+                db.rollback()
+                crud.release_job(db, job_id)
+                logger.info("Tarefa %s interrompida pelo desligamento; retomada na próxima partida", job_id)
+            except Exception as e:
+                db.rollback()
+                if isinstance(e, stock_import.SpreadsheetError):
+                    detail = str(e)
+                else:
+                    logger.exception("Falha na tarefa %s (%s)", job_id, job.kind)
+                    detail = f"Ocorreu um erro ao processar a tarefa: {e}"
+                crud.fail_job(db, job_id, detail)
+                self._discard_upload(job.params)
+                with self._lock:
+                    self.failed += 1
+            else:
+                self._discard_upload(job.params)
+                with self._lock:
+                    self.succeeded += 1
+            finally:
+                self._live.pop(job_id, None)
+        except Exception:
+            logger.exception("Falha ao executar a tarefa %s", job_id)
+        finally:
+            db.close()
+            with self._lock:
+                self._submitted.discard(job_id)
+
+    def _discard_upload(self, params: dict):
+        if params.get("upload"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path(params["upload"]))
+
+    def purge(self):
+        """Remove as tarefas concluídas há mais de JOB_RETENTION_HOURS e os seus arquivos."""
+        self._last_purge = datetime.now(timezone.utc)
+        db = self._session_factory()
+        try:
+            removed = crud.purge_finished_jobs(db, self._last_purge - self.retention)
+        finally:
+            db.close()
+        for row in removed:
+            if row.file:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.path(row.file))
+            self._discard_upload(row.params)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.running,
+            "workers": self.workers,
+            "running": len(self._live),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "requeued_on_start": self.requeued,
+        }
+
+
+job_runner = JobRunner(
+    SessionLocal,
+    coordinator.counters,
+    directory=settings.JOB_DIR,
+    workers=settings.JOB_WORKERS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    max_errors=settings.JOB_MAX_ERRORS,
+    retention=timedelta(hours=settings.JOB_RETENTION_HOURS),
+)
+
+
+@job_runner.handler("stock_import")
+def run_stock_import(runner: JobRunner, db, job: models.Job):
+    """
+    Aplica a planilha em lotes de IMPORT_CHUNK_SIZE linhas; cada lote é confirmado junto com
+    o progresso da tarefa, de onde a execução retoma depois de um reinício.
+    """
+    invalid, rows = stock_import.read_stock_spreadsheet(runner.path(job.params["upload"]))
+    # Os IDs repetidos são resolvidos na planilha inteira, não em cada lote
+    superseded, rows = stock_import.supersede_repeated_ids(rows)
+    skipped = sorted(invalid + superseded, key=lambda r: r["row"])
+    if job.total is None:
+        job.total = len(skipped) + len(rows)
+        job.processed = len(skipped)
+        job.errors = skipped[:runner.max_errors]
+        job.result = {"updated": 0, "not_found": 0, "invalid": len(invalid), "superseded": len(superseded)}
+        db.commit()
+
+    counts = dict(job.result)
+    errors = list(job.errors or [])
+    chunk_size = settings.IMPORT_CHUNK_SIZE
+    for start in range(job.processed - counts["invalid"] - counts.get("superseded", 0), len(rows), chunk_size):
+        runner.check_stop()
+        report = crud.bulk_set_stock_quantities(db, rows[start:start + chunk_size], username=job.username, commit=False)
+        missing = [r for r in report if r["status"] == "not_found"]
+        counts["updated"] += len(report) - len(missing)
+        counts["not_found"] += len(missing)
+        errors += missing[:runner.max_errors - len(errors)]
+        job.processed += len(report)
+        job.result = dict(counts)
+        job.errors = list(errors)
+        db.commit()
+        runner.report_progress(job.id, job.processed)
+
+    errors.sort(key=lambda r: r["row"])
+    not_found_ids = [str(r["item_id"]) for r in errors if r["status"] == "not_found"]
+    message = stock_import.import_log_action(counts["updated"], not_found_ids, counts["invalid"], counts.get("superseded", 0))
+    job.errors = errors
+    crud.finish_job(db, job, {"message": message, **counts}, commit=False)
+    # O log confirma a conclusão da tarefa no mesmo commit
+    crud.create_log_entry(db, username=job.username, action=message)
+
+
+@job_runner.handler("export")
+def run_export(runner: JobRunner, db, job: models.Job):
+    """Gera o arquivo em JOB_DIR (primeiro num .tmp, renomeado ao final)."""
+    params = job.params
+    header, fetch_rows = exports.SOURCES[params["source"]]
+    filters = dict(params.get("filters", {}))
+    for key in ("date_from", "date_to"):
+        if filters.get(key):
+            filters[key] = datetime.fromisoformat(filters[key])
+
+    count = 0
+
+    def rows():
+        nonlocal count
+        for row in fetch_rows(db, **filters):
+            yield row
+            count += 1
+            if count % EXPORT_PROGRESS_ROWS == 0:
+                runner.report_progress(job.id, count)
+                runner.check_stop()
+
+    body, _, extension = exports.render(params["format"], params["sheet_name"], header, rows())
+    name = f"{job.id}.{extension}"
+    tmp = runner.path(name + ".tmp")
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in body:
+                f.write(chunk)
+    except BaseException:
+        # O arquivo pode nem ter sido criado (falha no open): o erro original é o que importa
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, runner.path(name))
+
+    job.processed = job.total = count
+    crud.finish_job(db, job, {"rows": job.processed, "filename": f"{params['filename']}.{extension}"}, file=name)
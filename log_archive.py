@@ -0,0 +1,212 @@
+"""
+Retenção e arquivamento dos logs de atividade (log_entries).
+
+Com LOG_RETENTION_DAYS > 0, uma thread em segundo plano move periodicamente os logs
+mais antigos que o prazo para arquivos CSV comprimidos (gzip) em LOG_ARCHIVE_DIR, em
+blocos de até LOG_ARCHIVE_CHUNK_ROWS linhas, e os remove da tabela. Assim a tabela
+fica só com o período recente e o histórico antigo continua disponível para a
+exportação (GET /logs/export/excel?include_archived=true).
+
+Cada bloco vira um arquivo e uma entrada no manifest.json, com as chaves (timestamp, id)
+do primeiro e do último log. A ordem é: grava o arquivo, registra no manifesto e só
+então apaga as linhas do bloco, pelos ids exatos; se o processo cair no meio, a próxima
+execução apaga as sobras do último bloco (ids lidos do arquivo), sem arquivá-las de novo.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+import crud
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+COLUMNS = ["id", "timestamp", "username", "action"]
+
+
+def as_utc(value: datetime) -> datetime:
+    # O SQLite devolve as datas sem fuso; elas são gravadas em UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+class LogArchiver:
+    def __init__(self, session_factory, directory: str, retention_days: int, chunk_rows: int, interval: timedelta):
+        self._session_factory = session_factory
+        self.directory = directory
+        self.retention_days = retention_days
+        self.chunk_rows = chunk_rows
+        self.interval = interval
+        # Uma execução de arquivamento por vez
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.archived = 0
+        self.last_run: datetime | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.retention_days > 0
+
+    # --- Manifesto ---
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST)
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"chunks": []}
+
+    def _save_manifest(self, manifest: dict):
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._manifest_path())
+
+    def _chunk_ids(self, chunk: dict) -> list[int]:
+        with gzip.open(os.path.join(self.directory, chunk["file"]), "rt", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            next(reader)
+            return [int(row[0]) for row in reader]
+
+    # --- Arquivamento ---
+
+    def archive_once(self, now: datetime | None = None) -> int:
+        """Arquiva todos os logs mais antigos que o prazo de retenção. Devolve quantos foram movidos."""
+        if not self.enabled:
+            return 0
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=self.retention_days)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            manifest = self.load_manifest()
+            db = self._session_factory()
+            try:
+                if manifest["chunks"]:
+                    # Sobras de uma execução interrompida entre o manifesto e o DELETE
+                    crud.delete_log_entries(db, self._chunk_ids(manifest["chunks"][-1]))
+                moved = 0
+                while not self._stop.is_set():
+                    rows = crud.get_archivable_log_entries(db, cutoff, self.chunk_rows)
+                    if not rows:
+                        break
+                    chunk = self._write_chunk(rows)
+                    manifest["chunks"].append(chunk)
+                    self._save_manifest(manifest)
+                    deleted = crud.delete_log_entries(db, [row.id for row in rows])
+                    moved += len(rows)
+                    if deleted != len(rows):
+                        # A próxima consulta traria as mesmas linhas: para, em vez de arquivá-las de novo
+                        raise RuntimeError(f"Bloco {chunk['file']} arquivado, mas só {deleted} de {len(rows)} logs removidos")
+            finally:
+                db.close()
+            self.archived += moved
+            self.last_run = datetime.now(timezone.utc)
+        if moved:
+            logger.info("%s logs arquivados em %s", moved, self.directory)
+        return moved
+
+    def _write_chunk(self, rows) -> dict:
+        first, last = as_utc(rows[0].timestamp), as_utc(rows[-1].timestamp)
+        name = f"logs_{first:%Y%m%dT%H%M%S}_{rows[-1].id}.csv.gz"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as gz, io.TextIOWrapper(gz, encoding="utf-8", newline="") as text:
+                writer = csv.writer(text)
+                writer.writerow(COLUMNS)
+                for row in rows:
+                    writer.writerow([row.id, as_utc(row.timestamp).isoformat(), row.username, row.action])
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(path + ".tmp", path)
+        return {
+            "file": name,
+            "first": first.isoformat(),
+            "first_id": rows[0].id,
+            "last": last.isoformat(),
+            "last_id": rows[-1].id,
+            "rows": len(rows),
+        }
+
+    # --- Leitura ---
+
+    def iter_archived(self, date_from: datetime | None = None, date_to: datetime | None = None) -> Iterator[tuple]:
+        """
+        Logs arquivados no intervalo pedido, do mais recente ao mais antigo, como
+        (id, timestamp, username, action). Só os blocos que cruzam o intervalo são lidos.
+        """
+        date_from = as_utc(date_from) if date_from else None
+        date_to = as_utc(date_to) if date_to else None
+        # O manifesto é sempre substituído por inteiro (os.replace): dá para ler sem o lock
+        chunks = self.load_manifest()["chunks"]
+        for chunk in reversed(chunks):
+            if date_from and datetime.fromisoformat(chunk["last"]) < date_from:
+                continue
+            if date_to and datetime.fromisoformat(chunk["first"]) > date_to:
+                continue
+            with gzip.open(os.path.join(self.directory, chunk["file"]), "rt", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                next(reader)
+                # Os blocos são gravados em ordem crescente e têm tamanho limitado
+                rows = list(reader)
+            for log_id, timestamp, username, action in reversed(rows):
+                timestamp = datetime.fromisoformat(timestamp)
+                if (date_from and timestamp < date_from) or (date_to and timestamp > date_to):
+                    continue
+                yield int(log_id), timestamp, username, action
+
+    # --- Agendamento ---
+
+    def start(self):
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        thread = threading.Thread(target=self._run, name="log-archiver", daemon=True)
+        thread.start()
+        self._thread = thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(30)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.archive_once()
+            except Exception:
+                logger.exception("Falha ao arquivar os logs de atividade")
+            self._stop.wait(self.interval.total_seconds())
+
+    def stats(self) -> dict:
+        chunks = self.load_manifest()["chunks"] if self.enabled else []
+        return {
+            "retention_days": self.retention_days,
+            "archived_this_process": self.archived,
+            "archived_total": sum(chunk["rows"] for chunk in chunks),
+            "chunks": len(chunks),
+            "oldest": chunks[0]["first"] if chunks else None,
+            "newest": chunks[-1]["last"] if chunks else None,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
+
+
+log_archiver = LogArchiver(
+    SessionLocal,
+    directory=settings.LOG_ARCHIVE_DIR,
+    retention_days=settings.LOG_RETENTION_DAYS,
+    chunk_rows=settings.LOG_ARCHIVE_CHUNK_ROWS,
+    interval=timedelta(hours=settings.LOG_ARCHIVE_INTERVAL_HOURS),
+)
@@ -0,0 +1,129 @@
+"""
+Proteções do login (POST /token).
+
+A verificação bcrypt e a consulta ao banco rodam num pool de threads próprio e limitado
+(por padrão, um worker por núcleo), nunca no event loop. Se houver logins demais na fila,
+novos pedidos recebem 503; tentativas demais para o mesmo usuário recebem 429.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config import settings
+from metrics import Histogram
+
+
+class LoginOverloaded(Exception):
+    """Há logins demais aguardando verificação."""
+
+
+class LoginRateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class LoginRateLimiter:
+    """
+    Janela deslizante de `limit` tentativas a cada `window` segundos, por nome de usuário.
+
+    Os usuários ficam na ordem da última tentativa: os que saíram da janela estão sempre no
+    início e são descartados a cada chamada, cada um uma única vez. Acima de `max_users`
+    (nomes inventados em massa, por exemplo), descarta também os de tentativa mais antiga.
+    """
+
+    def __init__(self, limit: int, window: float, max_users: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+        self._attempts: OrderedDict[str, deque] = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def check(self, username: str):
+        now = time.monotonic()
+        expired = now - self.window
+        with self._lock:
+            attempts = self._attempts.get(username)
+            if attempts is None:
+                attempts = self._attempts[username] = deque()
+            while attempts and attempts[0] <= expired:
+                attempts.popleft()
+            if len(attempts) >= self.limit:
+                raise LoginRateLimited(retry_after=int(attempts[0] + self.window - now) + 1)
+            attempts.append(now)
+            self._attempts.move_to_end(username)
+            while True:
+                oldest = next(iter(self._attempts.values()))
+                if oldest[-1] > expired and len(self._attempts) <= self.max_users:
+                    break
+                self._attempts.popitem(last=False)
+                if oldest[-1] > expired:
+                    self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._attempts)
+
+
+class LoginGate:
+    """Executa a autenticação no pool de login, recusando pedidos além de `max_pending`."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        # Criado em start() (ou no primeiro login), para a aplicação poder partir de novo
+        # no mesmo processo depois de um shutdown()
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.latency = Histogram()
+        self.outcomes = {"success": 0, "failure": 0, "rate_limited": 0, "overloaded": 0}
+
+    def start(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="login")
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        executor = self._executor or self.start()
+        if self.pending >= self.max_pending:
+            self.outcomes["overloaded"] += 1
+            raise LoginOverloaded()
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            # Com o contexto da requisição, para as métricas contarem as consultas do login
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(executor, partial(context.run, fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self.latency.observe(time.perf_counter() - start)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "outcomes": dict(self.outcomes),
+            "latency_seconds": self.latency.snapshot(),
+        }
+
+
+login_gate = LoginGate(
+    # Os núcleos são divididos entre os workers da aplicação (WEB_CONCURRENCY)
+    workers=settings.LOGIN_WORKERS or max(1, (os.cpu_count() or 1) // settings.WEB_CONCURRENCY),
+    max_pending=settings.LOGIN_MAX_PENDING,
+)
+login_rate_limiter = LoginRateLimiter(settings.LOGIN_RATE_LIMIT, settings.LOGIN_RATE_WINDOW_SECONDS)
@@ -0,0 +1,284 @@
+"""
+Métricas simples em memória (por processo).
+
+Além do Histogram usado pelo login, mede cada requisição HTTP (MetricsMiddleware) e cada
+consulta SQL (eventos de cursor do SQLAlchemy), registra consultas lentas e gera o texto
+exposto em /metrics no formato do Prometheus.
+"""
+import bisect
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from config import settings
+
+
+class Histogram:
+    """Histograma de latências com limites fixos (em segundos), no estilo do Prometheus."""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        """Contagens acumuladas por limite ("le"), total de observações e soma."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = running + counts[-1]
+        return {"buckets": cumulative, "count": cumulative["+Inf"], "sum": total}
+
+
+# --- Instrumentação das requisições e do banco ---
+
+slow_query_logger = logging.getLogger("estoque.slow_query")
+
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500, 1000)
+
+
+class RequestStats:
+    """Consultas e tempo de banco da requisição atual (propagado às threads via contextvars)."""
+
+    __slots__ = ("scope", "queries", "db_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        return route_label(self.scope)
+
+
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def route_label(scope: dict) -> str:
+    # Modelo da rota ("/stock/{item_id}"), nunca o caminho real, para não explodir a cardinalidade
+    return getattr(scope.get("route"), "path", None) or "other"
+
+
+class RouteMetrics:
+    """Latência, consultas SQL e tempo de banco por rota, e respostas por código de status."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.queries: dict[tuple[str, str], Histogram] = {}
+        self.db_time: dict[tuple[str, str], Histogram] = {}
+        self.responses: defaultdict[tuple[str, str, int], int] = defaultdict(int)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        with self._lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram()
+                self.queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.db_time[key] = Histogram()
+            self.responses[(method, route, status)] += 1
+        self.latency[key].observe(seconds)
+        self.queries[key].observe(stats.queries)
+        self.db_time[key].observe(stats.db_seconds)
+
+
+class DatabaseMetrics:
+    """Totais de consultas do processo (inclusive das threads em segundo plano) e log de consultas lentas."""
+
+    def __init__(self, slow_query_seconds: float):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.seconds = 0.0
+        self.slow_queries = 0
+
+    def instrument(self, engine):
+        """Registra os eventos de cursor no engine (para o assíncrono, passe engine.sync_engine)."""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        with self._lock:
+            self.queries += 1
+            self.seconds += elapsed
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            with self._lock:
+                self.slow_queries += 1
+            slow_query_logger.warning(
+                "Consulta lenta (%.1f ms) na rota %s, parâmetros %s: %s",
+                elapsed * 1000,
+                stats.route if stats is not None else "-",
+                params_fingerprint(parameters, executemany),
+                " ".join(statement.split())[:2000],
+            )
+
+
+def params_fingerprint(parameters, executemany: bool) -> str:
+    """Identifica os parâmetros sem registrar seus valores: formato e hash curto."""
+    digest = hashlib.sha1(repr(parameters).encode()).hexdigest()[:12]
+    if executemany:
+        return f"{len(parameters)} conjuntos #{digest}"
+    size = len(parameters) if hasattr(parameters, "__len__") else 0
+    return f"{size} valores #{digest}"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sem BaseHTTPMiddleware, para não bufferizar respostas em
+    streaming): mede cada requisição e acumula em RouteMetrics. Streams de eventos
+    (text/event-stream) ficam fora dos histogramas de latência.
+    """
+
+    def __init__(self, app, route_metrics: RouteMetrics):
+        self.app = app
+        self.route_metrics = route_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status_code = 500
+        event_stream = False
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code, event_stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                event_stream = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            if not event_stream:
+                self.route_metrics.observe(
+                    scope["method"], route_label(scope), status_code, time.perf_counter() - start, stats,
+                )
+
+
+# --- Formato de texto do Prometheus ---
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _metric_name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(parts))
+
+
+def _histogram_lines(name: str, snapshot: dict, **labels) -> list[str]:
+    lines = [f"{name}_bucket{_labels(**labels, le=bound)} {count}" for bound, count in snapshot["buckets"].items()]
+    lines.append(f"{name}_sum{_labels(**labels)} {snapshot['sum']}")
+    lines.append(f"{name}_count{_labels(**labels)} {snapshot['count']}")
+    return lines
+
+
+def _stats_lines(prefix: str, value) -> list[str]:
+    """Converte os dicionários de /stats em métricas: números viram gauges, histogramas são mantidos."""
+    if isinstance(value, dict):
+        if {"buckets", "count", "sum"} <= value.keys():
+            return [f"# TYPE {prefix} histogram", *_histogram_lines(prefix, value)]
+        lines = []
+        for key, item in value.items():
+            lines += _stats_lines(_metric_name(prefix, str(key)), item)
+        return lines
+    if isinstance(value, (bool, int, float)):
+        return [f"# TYPE {prefix} gauge", f"{prefix} {float(value)}"]
+    return []
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    stats = {}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+def render_prometheus(route_metrics: RouteMetrics, db_metrics: DatabaseMetrics, pools: dict, stats: dict) -> str:
+    lines = []
+
+    with route_metrics._lock:
+        keys = list(route_metrics.latency)
+        responses = dict(route_metrics.responses)
+
+    lines += ["# HELP estoque_http_requests_total Respostas por rota e código de status.", "# TYPE estoque_http_requests_total counter"]
+    for (method, route, status), count in sorted(responses.items()):
+        lines.append(f"estoque_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+    for name, description, histograms in (
+        ("estoque_http_request_duration_seconds", "Latência das requisições.", route_metrics.latency),
+        ("estoque_http_request_db_queries", "Consultas SQL por requisição.", route_metrics.queries),
+        ("estoque_http_request_db_seconds", "Tempo de banco por requisição.", route_metrics.db_time),
+    ):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        for method, route in sorted(keys):
+            lines += _histogram_lines(name, histograms[(method, route)].snapshot(), method=method, route=route)
+
+    with db_metrics._lock:
+        totals = (db_metrics.queries, db_metrics.seconds, db_metrics.slow_queries)
+    for (name, description), value in zip((
+        ("estoque_db_queries_total", "Consultas SQL executadas pelo processo."),
+        ("estoque_db_query_seconds_total", "Tempo total das consultas SQL."),
+        ("estoque_db_slow_queries_total", "Consultas acima de SLOW_QUERY_SECONDS."),
+    ), totals):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter", f"{name} {value}"]
+
+    for stat in ("size", "checkedin", "checkedout", "overflow"):
+        name = f"estoque_db_pool_{stat}"
+        lines.append(f"# TYPE {name} gauge")
+        for engine_name, pool in pools.items():
+            if stat in pool:
+                lines.append(f"{name}{_labels(engine=engine_name)} {pool[stat]}")
+
+    for section, values in stats.items():
+        lines += _stats_lines(_metric_name("estoque", section), values)
+
+    return "\n".join(lines) + "\n"
+
+
+route_metrics = RouteMetrics()
+db_metrics = DatabaseMetrics(slow_query_seconds=settings.SLOW_QUERY_SECONDS)
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -27,7 +28,106 @@ class StockItem(Base):
 class LogEntry(Base):
     __tablename__ = "log_entries"
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # O valor é gerado na aplicação para que todas as linhas tenham o mesmo formato (o SQLite
+    # grava CURRENT_TIMESTAMP sem microssegundos), o que a paginação por (timestamp, id) exige
+    timestamp = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
     action = Column(String, nullable=False)
     username = Column(String, nullable=False)
 
+    __table_args__ = (
+        Index("ix_log_entries_timestamp_id", "timestamp", "id"),
+        Index("ix_log_entries_username_timestamp", "username", "timestamp"),
+    )
+
+class IdempotencyKey(Base):
+    """
+    Resposta de uma movimentação já aplicada, guardada pela chave enviada no cabeçalho
+    Idempotency-Key, para que reenvios do cliente não sejam contados duas vezes.
+    """
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    username = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
+
+class StockLedgerEntry(Base):
+    """
+    Razão de movimentações (somente inclusão): uma linha por alteração de estoque,
+    com a variação e o saldo resultante do item.
+    """
+    __tablename__ = "stock_movements"
+    id = Column(Integer, primary_key=True)
+    # Sem chave estrangeira: o histórico continua disponível depois que o item é excluído
+    item_id = Column(Integer, nullable=False)
+    item_name = Column(String, nullable=False)
+    # criacao, entrada, saida, importacao ou exclusao
+    kind = Column(String, nullable=False)
+    delta = Column(Integer, nullable=False)
+    balance = Column(Integer, nullable=False)
+    username = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc), index=True)
+    # Movimentações anteriores ao razão, reconstruídas dos logs de atividade
+    # (crud.backfill_stock_ledger): id do log de origem; nulo nas gravadas pela aplicação
+    log_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_stock_movements_item_id_created_at", "item_id", "created_at"),
+    )
+
+class StockSnapshotRun(Base):
+    """Registro de cada fotografia gravada, mesmo quando o estoque estava vazio."""
+    __tablename__ = "stock_snapshot_runs"
+    taken_at = Column(DateTime(timezone=True), primary_key=True)
+    item_count = Column(Integer, nullable=False)
+    # Maior id do razão já refletido na fotografia: as consultas históricas aplicam só as
+    # movimentações com id acima dele (nulo nas fotografias anteriores a esta coluna)
+    ledger_id = Column(Integer, nullable=True)
+
+class StockSnapshot(Base):
+    """Fotografia periódica do estoque de todos os itens, ponto de partida das consultas históricas."""
+    __tablename__ = "stock_snapshots"
+    id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime(timezone=True), nullable=False)
+    item_id = Column(Integer, nullable=False)
+    name = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_stock_snapshots_taken_at_item_id", "taken_at", "item_id"),
+    )
+
+class SchemaVersion(Base):
+    """Impressão digital do esquema aplicado na última partida (ver startup.ensure_schema)."""
+    __tablename__ = "schema_version"
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    search_backend = Column(String, nullable=False)
+    applied_at = Column(DateTime(timezone=True), nullable=False)
+
+class Job(Base):
+    """Tarefa em segundo plano (importação de planilha ou exportação), executada por jobs.JobRunner."""
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    # stock_import ou export
+    kind = Column(String, nullable=False)
+    # queued, running, succeeded ou failed
+    status = Column(String, nullable=False, default="queued")
+    username = Column(String, nullable=False)
+    params = Column(JSON, nullable=False)
+    total = Column(Integer, nullable=True)
+    processed = Column(Integer, nullable=False, default=0)
+    result = Column(JSON, nullable=True)
+    # Linhas com problema (limitadas a JOB_MAX_ERRORS) e motivo da falha da tarefa
+    errors = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    # Arquivo gerado em JOB_DIR (exportações)
+    file = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+    )
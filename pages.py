@@ -0,0 +1,110 @@
+"""
+Páginas HTML e arquivos estáticos.
+
+As páginas (login, admin, stock, logs) só dependem de ROOT_PATH: são renderizadas uma vez
+na partida e servidas da memória, já comprimidas em cada codificação suportada, com ETag
+(o navegador revalida e recebe 304 até a próxima implantação).
+
+Os arquivos de /static recebem uma impressão digital (hash do conteúdo) na URL gerada por
+StaticAssets.url, como /static/logo.png?v=<hash>. Pedidos com a impressão digital atual são
+servidos com cache longo (immutable); os demais, com revalidação pela ETag. Quando o
+arquivo muda, a URL nas páginas muda junto.
+"""
+import hashlib
+import os
+from typing import NamedTuple
+from urllib.parse import parse_qs
+
+import jinja2
+from fastapi import Request, Response, status
+from fastapi.staticfiles import StaticFiles
+
+from compression import available_encodings, choose_encoding, compress
+from config import settings
+
+LONG_CACHE = "public, max-age=31536000, immutable"
+# Níveis máximos: a compressão das páginas é feita uma única vez
+PAGE_COMPRESSION_LEVELS = {"br": 11, "gzip": 9}
+
+
+class Page(NamedTuple):
+    body: bytes
+    etag: str
+    encoded: dict[str, bytes]
+
+
+class StaticAssets:
+    """Impressões digitais dos arquivos de `directory`, calculadas na partida."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.fingerprints: dict[str, str] = {}
+
+    def load(self):
+        fingerprints = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full = os.path.join(root, name)
+                with open(full, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:12]
+                fingerprints[os.path.relpath(full, self.directory).replace(os.sep, "/")] = digest
+        self.fingerprints = fingerprints
+
+    def url(self, path: str) -> str:
+        version = self.fingerprints.get(path)
+        url = f"{settings.ROOT_PATH}/static/{path}"
+        return f"{url}?v={version}" if version else url
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """StaticFiles com cache longo para as URLs com a impressão digital atual do arquivo."""
+
+    def __init__(self, *, assets: StaticAssets, **kwargs):
+        super().__init__(directory=assets.directory, **kwargs)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            version = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("v", [None])[0]
+            current = self.assets.fingerprints.get(path.replace(os.sep, "/"))
+            response.headers["Cache-Control"] = LONG_CACHE if version and version == current else "no-cache"
+        return response
+
+
+class PageCache:
+    def __init__(self, directory: str, assets: StaticAssets):
+        self.env = jinja2.Environment(loader=jinja2.FileSystemLoader(directory), autoescape=True)
+        self.assets = assets
+        self._pages: dict[str, Page] = {}
+
+    def render_all(self, names: list[str]):
+        for name in names:
+            body = self.env.get_template(name).render(
+                root_path=settings.ROOT_PATH,
+                # Mesma assinatura do url_for dos templates do Starlette, restrita a /static
+                url_for=lambda route, path: self.assets.url(path),
+            ).encode()
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:16]}"'
+            encoded = {
+                encoding: compress(body, encoding, PAGE_COMPRESSION_LEVELS[encoding])
+                for encoding in available_encodings()
+            }
+            self._pages[name] = Page(body, etag, encoded)
+
+    def response(self, request: Request, name: str) -> Response:
+        page = self._pages[name]
+        headers = {"ETag": page.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if page.etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        body = page.body
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), page.encoded)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            body = page.encoded[encoding]
+        return Response(content=body, media_type="text/html", headers=headers)
+
+
+static_assets = StaticAssets("static")
+page_cache = PageCache("templates", static_assets)
@@ -0,0 +1,23 @@
+"""
+Cursores opacos para paginação por chave (keyset).
+O cliente recebe `next_cursor` e o devolve sem interpretar; o conteúdo é um JSON em base64.
+"""
+import base64
+import json
+
+
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Decodifica um cursor gerado por encode_cursor(). Lança ValueError se for inválido."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise ValueError("Cursor de paginação inválido.")
+    if not isinstance(values, dict):
+        raise ValueError("Cursor de paginação inválido.")
+    return values
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, Field
+from datetime import date, datetime
 from typing import Literal
 
 class Token(BaseModel):
@@ -45,9 +45,129 @@ class StockItem(StockItemBase):
     class Config:
         from_attributes = True
 
+class StockItemPage(BaseModel):
+    items: list[StockItem]
+    next_cursor: str | None = None
+
 class StockMovement(BaseModel):
     type: Literal['entrada', 'saida']
+    quantity: int = Field(gt=0)
+
+class StockImportRow(BaseModel):
+    row: int
+    item_id: int | None = None
+    status: Literal['updated', 'not_found', 'invalid', 'superseded']
+    detail: str | None = None
+
+class StockImportReport(BaseModel):
+    message: str
+    updated: int
+    not_found: int
+    invalid: int
+    superseded: int = 0
+    rows: list[StockImportRow]
+
+class Job(BaseModel):
+    """Situação de uma tarefa em segundo plano (GET /jobs/{id})."""
+    id: str
+    kind: Literal['stock_import', 'export']
+    status: Literal['queued', 'running', 'succeeded', 'failed']
+    username: str
+    total: int | None = None
+    processed: int
+    result: dict | None = None
+    # Linhas da planilha com problema (inválidas ou com ID não encontrado)
+    errors: list[StockImportRow] = []
+    error: str | None = None
+    download_url: str | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+class StockLedgerEntry(BaseModel):
+    id: int
+    item_id: int
+    item_name: str
+    kind: str
+    delta: int
+    balance: int
+    username: str | None = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class StockHistoryPage(BaseModel):
+    items: list[StockLedgerEntry]
+    next_cursor: str | None = None
+
+class StockItemAsOf(BaseModel):
+    id: int
+    name: str
+    quantity: int
+
+class StockAsOfPage(BaseModel):
+    as_of: datetime
+    items: list[StockItemAsOf]
+    next_cursor: str | None = None
+
+class ItemConsumption(BaseModel):
+    id: int
+    name: str
+    quantity: int
+    # Saídas no período pedido e nos últimos 7 dias (ambos incluindo hoje)
+    consumed: int
+    consumed_7d: int
+    avg_daily: float
+    avg_daily_7d: float
+    # Ao ritmo de avg_daily; None quando não houve saídas no período
+    days_until_stockout: float | None = None
+    stockout_date: date | None = None
+    last_consumed_on: date | None = None
+
+class StockAnalytics(BaseModel):
+    generated_on: date
+    window_days: int
+    items_analyzed: int
+    items_consuming: int
+    items: list[ItemConsumption]
+
+class ItemConsumptionDay(BaseModel):
+    day: date
+    consumed: int
+    # Média das saídas dos 7 dias terminados neste dia
+    moving_avg: float
+
+class ItemConsumptionHistory(BaseModel):
+    id: int
+    name: str
     quantity: int
+    window_days: int
+    avg_daily: float
+    days_until_stockout: float | None = None
+    stockout_date: date | None = None
+    days: list[ItemConsumptionDay]
+
+class StockMovementLine(StockMovement):
+    item_id: int
+
+class StockMovementBatch(BaseModel):
+    movements: list[StockMovementLine] = Field(min_length=1, max_length=1000)
+    # all_or_nothing: qualquer linha inválida cancela o lote; best_effort: aplica as linhas válidas
+    mode: Literal['all_or_nothing', 'best_effort'] = 'all_or_nothing'
+
+class StockMovementResult(BaseModel):
+    line: int
+    item_id: int
+    status: Literal['applied', 'not_found', 'insufficient', 'skipped']
+    quantity: int | None = None
+    detail: str | None = None
+
+class StockMovementBatchResult(BaseModel):
+    committed: bool
+    applied: int
+    failed: int
+    results: list[StockMovementResult]
 
 class LogEntry(BaseModel):
     id: int
@@ -58,3 +178,6 @@ class LogEntry(BaseModel):
     class Config:
         from_attributes = True
 
+class LogEntryPage(BaseModel):
+    items: list[LogEntry]
+    next_cursor: str | None = None
@@ -0,0 +1,101 @@
+"""
+Agendador das fotografias periódicas do estoque (stock_snapshots).
+
+Uma thread em segundo plano grava uma nova fotografia sempre que a mais recente
+tiver mais de STOCK_SNAPSHOT_INTERVAL_HOURS. Assim, uma consulta histórica nunca
+precisa percorrer mais do que um intervalo de movimentações. Depois de cada fotografia,
+as mais antigas que STOCK_SNAPSHOT_RETENTION_DAYS são removidas (a mais recente fica).
+
+A mesma thread remove, a cada verificação, as Idempotency-Keys com mais de
+IDEMPOTENCY_KEY_TTL_HOURS, para a tabela não crescer enquanto o processo fica no ar.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+import crud
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Intervalo máximo entre verificações, para reagir a mudanças de relógio e ao encerramento
+CHECK_SECONDS = 300
+
+
+class SnapshotScheduler:
+    def __init__(
+        self,
+        session_factory,
+        interval: timedelta,
+        retention: timedelta | None = None,
+        idempotency_ttl: timedelta | None = None,
+    ):
+        self._session_factory = session_factory
+        self.interval = interval
+        self.retention = retention
+        self.idempotency_ttl = idempotency_ttl
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        thread = threading.Thread(target=self._run, name="stock-snapshots", daemon=True)
+        thread.start()
+        self._thread = thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(10)
+            self._thread = None
+
+    def run_if_due(self) -> float:
+        """Grava a fotografia se estiver vencida; devolve quantos segundos faltam para a próxima."""
+        db = self._session_factory()
+        try:
+            latest = crud.get_latest_snapshot_time(db)
+            now = datetime.now(timezone.utc)
+            if latest is not None and latest.tzinfo is None:
+                latest = latest.replace(tzinfo=timezone.utc)
+            if latest is None or now - latest >= self.interval:
+                latest = crud.take_stock_snapshot(db)
+                if self.retention is not None:
+                    removed = crud.purge_stock_snapshots(db, older_than=latest - self.retention)
+                    if removed:
+                        logger.info("%s fotografias antigas do estoque removidas", removed)
+            return (latest + self.interval - now).total_seconds()
+        finally:
+            db.close()
+
+    def purge_idempotency_keys(self) -> int:
+        if self.idempotency_ttl is None:
+            return 0
+        db = self._session_factory()
+        try:
+            return crud.purge_idempotency_keys(db, datetime.now(timezone.utc) - self.idempotency_ttl)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                wait = self.run_if_due()
+            except Exception:
+                logger.exception("Falha ao gravar a fotografia do estoque")
+                wait = CHECK_SECONDS
+            try:
+                self.purge_idempotency_keys()
+            except Exception:
+                logger.exception("Falha ao remover as Idempotency-Keys vencidas")
+            self._stop.wait(min(max(wait, 1), CHECK_SECONDS))
+
+
+snapshot_scheduler = SnapshotScheduler(
+    SessionLocal,
+    timedelta(hours=settings.STOCK_SNAPSHOT_INTERVAL_HOURS),
+    timedelta(days=settings.STOCK_SNAPSHOT_RETENTION_DAYS) if settings.STOCK_SNAPSHOT_RETENTION_DAYS > 0 else None,
+    timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+)
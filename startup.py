@@ -0,0 +1,217 @@
+"""
+Partida da aplicação: verificação do esquema e relatório de tempos.
+
+A criação das tabelas, dos índices e das estruturas de busca só roda quando a impressão
+digital do esquema (tabelas, colunas, índices e instruções de stock_search) difere da
+gravada em schema_version na última partida. As tarefas que não precisam bloquear a
+partida (como os serviços de segundo plano) rodam numa thread; a aplicação só se
+declara pronta (GET /health/ready) depois delas. Uma etapa que falha é tentada de novo,
+com espera crescente; esgotadas as tentativas, a aplicação fica pronta mesmo assim e o
+erro aparece em /health/ready e /stats, em vez de o processo ficar fora do ar para sempre.
+"""
+import contextlib
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+import crud, models, stock_search
+from database import Base
+
+logger = logging.getLogger(__name__)
+
+# Tentativas de cada etapa em segundo plano e espera inicial entre elas (dobra a cada falha)
+BACKGROUND_ATTEMPTS = 5
+BACKGROUND_RETRY_SECONDS = 2.0
+BACKGROUND_RETRY_MAX_SECONDS = 60.0
+
+# Correções de dados aplicadas junto com o esquema. Entram na impressão digital, então uma
+# correção nova roda uma vez na próxima partida de cada banco.
+DATA_MIGRATIONS = [
+    "log_entries.timestamp com microssegundos (SQLite)",
+    "stock_movements reconstruídas dos logs anteriores ao razão",
+]
+
+
+def schema_fingerprint() -> str:
+    parts = [stock_search.setup_fingerprint(), *DATA_MIGRATIONS]
+    for table in Base.metadata.sorted_tables:
+        parts.append(f"table {table.name}")
+        for col in table.columns:
+            parts.append(f"  {col.name} {col.type!r} nullable={col.nullable} pk={col.primary_key}")
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            parts.append(f"  index {index.name} {[str(expr) for expr in index.expressions]} unique={index.unique}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def ensure_schema(engine: Engine) -> bool:
+    """Aplica o esquema se ele mudou desde a última partida. Devolve True se aplicou."""
+    fingerprint = schema_fingerprint()
+    try:
+        with engine.connect() as conn:
+            stored = conn.execute(
+                select(models.SchemaVersion.fingerprint, models.SchemaVersion.search_backend)
+                .where(models.SchemaVersion.id == 1)
+            ).first()
+    except DBAPIError:
+        # Banco novo: a tabela schema_version ainda não existe
+        stored = None
+    if stored is not None and stored.fingerprint == fingerprint:
+        stock_search.use_backend(stored.search_backend)
+        return False
+
+    Base.metadata.create_all(bind=engine)
+    # create_all não cria índices novos em tabelas que já existem
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    add_missing_columns(engine)
+    stock_search.setup_stock_search(engine)
+    normalize_log_timestamps(engine)
+    backfill_stock_ledger(engine)
+
+    # Com a busca em ILIKE (instalação falhou), a versão não é gravada e a instalação é tentada de novo
+    if stock_search.backend != "like":
+        with engine.begin() as conn:
+            values = {"fingerprint": fingerprint, "search_backend": stock_search.backend, "applied_at": datetime.now(timezone.utc)}
+            updated = conn.execute(models.SchemaVersion.__table__.update().where(models.SchemaVersion.id == 1).values(**values))
+            if not updated.rowcount:
+                conn.execute(models.SchemaVersion.__table__.insert().values(id=1, **values))
+    return True
+
+
+def add_missing_columns(engine: Engine):
+    """
+    create_all também não acrescenta colunas a tabelas que já existem. As colunas novas que
+    aceitam nulo entram aqui com ALTER TABLE; as obrigatórias exigem uma migração própria.
+    """
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            present = {col["name"] for col in existing.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in present or not col.nullable:
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=engine.dialect)}"
+                ))
+                logger.info("Coluna %s.%s acrescentada", table.name, col.name)
+
+
+def normalize_log_timestamps(engine: Engine):
+    """
+    No SQLite, os logs gravados pelo server_default (CURRENT_TIMESTAMP) não têm os
+    microssegundos ('2026-07-09 20:17:51') que o SQLAlchemy grava e usa nos parâmetros
+    ('2026-07-09 20:17:51.000000'). Como a comparação é de texto, a paginação por
+    (timestamp, id) e os intervalos do arquivamento erravam nessas linhas: elas passam
+    para o formato completo.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        updated = conn.execute(text(
+            "UPDATE log_entries SET timestamp = timestamp || '.000000' WHERE length(timestamp) = 19"
+        )).rowcount
+    if updated:
+        logger.info("%s logs com horário sem microssegundos normalizados", updated)
+
+
+def backfill_stock_ledger(engine: Engine):
+    """
+    Bancos em uso antes do razão (stock_movements) só têm as movimentações nos logs de
+    atividade: elas entram no razão uma vez, para a análise de consumo e o histórico dos itens.
+    """
+    with Session(engine) as db:
+        added = crud.backfill_stock_ledger(db)
+    if added:
+        logger.info("%s movimentações reconstruídas dos logs de atividade", added)
+
+
+class StartupReport:
+    """Duração de cada etapa da partida (em segundos) e o momento em que a aplicação ficou pronta."""
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.timings: dict[str, float] = {}
+        self.schema_applied: bool | None = None
+        self.error: str | None = None
+        self.retries = 0
+        self._ready = threading.Event()
+        self._cancel = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 4)
+
+    def record_import(self, started: float):
+        """Registra a importação do app; `until_ready` passa a contar a partir do início dela."""
+        self.created = started
+        self.timings["import"] = round(time.perf_counter() - started, 4)
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def mark_ready(self):
+        self.timings["until_ready"] = round(time.perf_counter() - self.created, 4)
+        self._ready.set()
+
+    def run_in_background(self, *tasks):
+        """Executa as etapas (nome, função) numa thread e marca a aplicação como pronta no fim."""
+        def run():
+            for name, task in tasks:
+                delay = BACKGROUND_RETRY_SECONDS
+                for attempt in range(1, BACKGROUND_ATTEMPTS + 1):
+                    if self._cancel.is_set():
+                        return
+                    try:
+                        with self.phase(name):
+                            task()
+                        break
+                    except Exception as e:
+                        logger.exception("Falha na etapa %s da partida (tentativa %s de %s)", name, attempt, BACKGROUND_ATTEMPTS)
+                        self.retries += 1
+                        if attempt == BACKGROUND_ATTEMPTS:
+                            self.error = f"{name}: {e}"
+                            break
+                        self._cancel.wait(delay)
+                        delay = min(delay * 2, BACKGROUND_RETRY_MAX_SECONDS)
+            self.mark_ready()
+
+        self._cancel.clear()
+        thread = threading.Thread(target=run, name="startup", daemon=True)
+        thread.start()
+        self._thread = thread
+
+    def stop_background(self, timeout: float = 30):
+        """
+        Cancela as etapas que ainda não começaram e espera a que está em andamento, para que
+        o encerramento não pare um serviço no meio da partida dele.
+        """
+        self._cancel.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "schema_applied": self.schema_applied,
+            "error": self.error,
+            "retries": self.retries,
+            "seconds": dict(self.timings),
+        }
+
+
+startup_report = StartupReport()
@@ -0,0 +1,311 @@
+"""
+Análise de consumo do estoque (GET /stock/analytics e /stock/analytics/{item_id}).
+
+A fonte são as saídas do razão de movimentações (stock_movements, kind "saida"), que já
+guarda item, tipo, quantidade e horário em colunas: não é preciso interpretar o texto dos
+logs. O banco soma as saídas por item e dia; os totais dos dias encerrados não mudam mais
+e ficam em memória (arrays NumPy com até ANALYTICS_HISTORY_DAYS dias), carregados por
+inteiro numa thread logo após a partida (ou na primeira consulta) e depois acrescidos só dos dias que se encerraram desde então.
+A cada consulta, só as saídas do dia corrente vão ao banco; médias e previsão de ruptura
+são calculadas com operações vetorizadas sobre os arrays.
+
+As médias dividem pelo período em que o item existe no razão (a partir da primeira linha
+dele), se for menor que a janela: um item novo, ou o razão recém-implantado, não tem o
+consumo diluído por dias sem histórico.
+
+Os dias são contados em UTC. Um dia só é dado como encerrado CLOSE_GRACE depois da
+meia-noite, para que transações confirmadas logo após a virada (com horário do dia
+anterior) ainda entrem na soma.
+"""
+import logging
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import TYPE_CHECKING, NamedTuple
+
+import crud
+from config import settings
+from database import SessionLocal
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CLOSE_GRACE = timedelta(minutes=10)
+# Janela da média móvel curta (campos *_7d da resposta)
+SHORT_WINDOW_DAYS = 7
+
+
+class DailyConsumption(NamedTuple):
+    """Consumo por item e dia, em arrays paralelos ordenados por dia (dias contados desde 1970-01-01)."""
+    items: "np.ndarray"
+    days: "np.ndarray"
+    consumed: "np.ndarray"
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def epoch_day(day: date) -> int:
+    return (day - date(1970, 1, 1)).days
+
+
+def from_epoch_day(day: int) -> date:
+    return date(1970, 1, 1) + timedelta(days=int(day))
+
+
+def to_arrays(rows) -> DailyConsumption:
+    """Linhas (item_id, day, consumed) de crud.get_daily_consumption em arrays ordenados por dia."""
+    # Importado só aqui: o numpy pesa na partida e só a análise o usa
+    import numpy as np
+
+    if not rows:
+        return DailyConsumption(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64))
+    items, days, consumed = zip(*rows)
+    # O SQLite devolve o dia em texto (AAAA-MM-DD) e o PostgreSQL como date: o numpy lê os dois
+    days = np.array(days, dtype="datetime64[D]").astype(np.int64)
+    order = np.argsort(days, kind="stable")
+    return DailyConsumption(np.array(items, np.int64)[order], days[order], np.array(consumed, np.int64)[order])
+
+
+def to_first_days(rows) -> tuple["np.ndarray", "np.ndarray"]:
+    """Linhas (item_id, day) de crud.get_first_movement_days em arrays (ids, dias)."""
+    import numpy as np
+
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    ids, days = zip(*rows)
+    return np.array(ids, np.int64), np.array(days, dtype="datetime64[D]").astype(np.int64)
+
+
+def merge_first_days(*parts: tuple) -> tuple["np.ndarray", "np.ndarray"]:
+    """Junta pares (ids, dias) ficando com o menor dia de cada item."""
+    import numpy as np
+
+    ids = np.concatenate([part[0] for part in parts])
+    days = np.concatenate([part[1] for part in parts])
+    order = np.lexsort((days, ids))
+    unique_ids, index = np.unique(ids[order], return_index=True)
+    return unique_ids, days[order][index]
+
+
+class Snapshot(NamedTuple):
+    """Estado usado por uma consulta: dias encerrados, dias abertos e datas por item."""
+    closed: DailyConsumption
+    recent: DailyConsumption
+    # (ids, dia) da última saída até os dias encerrados e da primeira linha do item no razão
+    last_day: tuple
+    first_day: tuple
+    today: int
+
+
+def concat(*parts: DailyConsumption) -> DailyConsumption:
+    import numpy as np
+
+    return DailyConsumption(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+
+def since_day(data: DailyConsumption, first: int) -> DailyConsumption:
+    """Recorte (sem cópia) a partir do dia `first`."""
+    import numpy as np
+
+    start = int(np.searchsorted(data.days, first, side="left"))
+    return DailyConsumption(data.items[start:], data.days[start:], data.consumed[start:])
+
+
+class ConsumptionAnalytics:
+    def __init__(self, history_days: int):
+        self.history_days = history_days
+        self._lock = threading.Lock()
+        self._closed: DailyConsumption | None = None
+        # Último dia encerrado em memória e, por item, o último dia com saída até ele
+        self._closed_through: date | None = None
+        self._last_day: tuple | None = None
+        self._first_day: tuple | None = None
+        self.loads = 0
+        self.refreshes = 0
+
+    @staticmethod
+    def today() -> date:
+        return datetime.now(timezone.utc).date()
+
+    def _closed_days(self, db, closed_through: date) -> tuple[DailyConsumption, tuple, tuple]:
+        """Totais dos dias encerrados até `closed_through`, buscando no banco só os que faltam."""
+        import numpy as np
+
+        with self._lock:
+            if self._closed_through is not None and self._closed_through >= closed_through:
+                return self._closed, self._last_day, self._first_day
+            first = closed_through - timedelta(days=self.history_days - 1)
+            until = day_start(closed_through + timedelta(days=1))
+            if self._closed_through is None or self._closed_through < first:
+                since, base = first, None
+                # A primeira linha de cada item pode ser anterior ao histórico mantido
+                self._first_day = to_first_days(crud.get_first_movement_days(db, until=until))
+                self.loads += 1
+            else:
+                since, base = self._closed_through + timedelta(days=1), self._closed
+                self._first_day = merge_first_days(
+                    self._first_day, to_first_days(crud.get_first_movement_days(db, day_start(since), until)),
+                )
+                self.refreshes += 1
+            added = to_arrays(crud.get_daily_consumption(db, day_start(since), until))
+            closed = since_day(concat(base, added), epoch_day(first)) if base is not None else added
+            # Último dia com saída de cada item: os arrays estão em ordem de dia, então basta
+            # a última ocorrência do item
+            reversed_items = closed.items[::-1]
+            ids, index = np.unique(reversed_items, return_index=True)
+            self._closed, self._last_day = closed, (ids, closed.days[::-1][index])
+            self._closed_through = closed_through
+            return self._closed, self._last_day, self._first_day
+
+    def warm_up(self):
+        """Carrega os dias encerrados fora de uma requisição (a primeira soma percorre todo o histórico)."""
+        db = SessionLocal()
+        try:
+            self._closed_days(db, (datetime.now(timezone.utc) - CLOSE_GRACE).date() - timedelta(days=1))
+        except Exception:
+            logger.exception("Falha ao carregar o histórico de consumo")
+        finally:
+            db.close()
+
+    def start_warm_up(self):
+        threading.Thread(target=self.warm_up, name="analytics-warm-up", daemon=True).start()
+
+    def _current(self, db) -> Snapshot:
+        now = datetime.now(timezone.utc)
+        closed_through = (now - CLOSE_GRACE).date() - timedelta(days=1)
+        closed, last_day, first_day = self._closed_days(db, closed_through)
+        open_since = day_start(closed_through + timedelta(days=1))
+        recent = to_arrays(crud.get_daily_consumption(db, open_since))
+        first_day = merge_first_days(first_day, to_first_days(crud.get_first_movement_days(db, open_since)))
+        return Snapshot(closed, recent, last_day, first_day, epoch_day(now.date()))
+
+    @staticmethod
+    def _divisors(age, window: int):
+        """Dias de cada média: a janela, ou só os dias desde a primeira linha do item, se forem menos."""
+        import numpy as np
+
+        return np.clip(np.minimum(age, window), 1, None)
+
+    def report(self, db, window: int = 30, limit: int = 100, max_days: float | None = None) -> dict:
+        """
+        Consumo de cada item nos últimos `window` dias (incluindo hoje) e nos últimos
+        SHORT_WINDOW_DAYS, médias diárias e dias até a ruptura ao ritmo da média do período.
+        Os itens são ordenados pela ruptura mais próxima; com `max_days`, ficam só os que
+        acabam dentro desse prazo.
+        """
+        import numpy as np
+
+        closed, recent, last_day, first_day, today = self._current(db)
+        first = today - window + 1
+        data = concat(since_day(closed, min(first, today - SHORT_WINDOW_DAYS + 1)), recent)
+
+        levels = crud.get_stock_levels(db)
+        ids = np.fromiter((row.id for row in levels), np.int64, len(levels))
+        quantities = np.fromiter((row.quantity for row in levels), np.int64, len(levels))
+        names = [row.name for row in levels]
+
+        def positions(items):
+            """Posição de cada item em `ids` (-1 para itens que já foram excluídos)."""
+            if not len(ids):
+                return np.full(len(items), -1)
+            order = np.argsort(ids)
+            found = np.searchsorted(ids[order], items).clip(max=len(ids) - 1)
+            return np.where(ids[order][found] == items, order[found], -1)
+
+        pos = positions(data.items)
+        kept = (pos >= 0) & (data.days >= first)
+        short = (pos >= 0) & (data.days > today - SHORT_WINDOW_DAYS)
+        consumed = np.bincount(pos[kept], weights=data.consumed[kept], minlength=len(ids))
+        consumed_short = np.bincount(pos[short], weights=data.consumed[short], minlength=len(ids))
+        # Dias desde a primeira linha de cada item no razão (itens sem nenhuma: a janela inteira)
+        age = np.full(len(ids), max(window, SHORT_WINDOW_DAYS), np.int64)
+        first_pos = positions(first_day[0])
+        age[first_pos[first_pos >= 0]] = today - first_day[1][first_pos >= 0] + 1
+        avg = consumed / self._divisors(age, window)
+        avg_short = consumed_short / self._divisors(age, SHORT_WINDOW_DAYS)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days_left = np.where(avg > 0, quantities / avg, np.nan)
+
+        last = np.full(len(ids), -1, np.int64)
+        closed_ids, closed_days = last_day
+        closed_pos = positions(closed_ids)
+        last[closed_pos[closed_pos >= 0]] = closed_days[closed_pos >= 0]
+        recent_pos = positions(recent.items)
+        np.maximum.at(last, recent_pos[recent_pos >= 0], recent.days[recent_pos >= 0])
+
+        selected = np.arange(len(ids))
+        if max_days is not None:
+            selected = selected[days_left <= max_days]
+        # Ruptura mais próxima primeiro; itens sem saída no período (NaN) por último
+        selected = selected[np.lexsort((ids[selected], days_left[selected]))][:limit]
+
+        items = []
+        for i in selected.tolist():
+            left = days_left[i]
+            items.append({
+                "id": int(ids[i]),
+                "name": names[i],
+                "quantity": int(quantities[i]),
+                "consumed": int(consumed[i]),
+                "consumed_7d": int(consumed_short[i]),
+                "avg_daily": round(float(avg[i]), 3),
+                "avg_daily_7d": round(float(avg_short[i]), 3),
+                "days_until_stockout": None if np.isnan(left) else round(float(left), 1),
+                "stockout_date": None if np.isnan(left) else from_epoch_day(today + int(left)),
+                "last_consumed_on": from_epoch_day(last[i]) if last[i] >= 0 else None,
+            })
+        return {
+            "generated_on": from_epoch_day(today),
+            "window_days": window,
+            "items_analyzed": len(ids),
+            "items_consuming": int(np.count_nonzero(consumed)),
+            "items": items,
+        }
+
+    def item_history(self, db, item, window: int = 30) -> dict:
+        """Consumo diário do item nos últimos `window` dias, com a média móvel de SHORT_WINDOW_DAYS dias."""
+        import numpy as np
+
+        closed, recent, _, first_day, today = self._current(db)
+        # Os dias anteriores à janela completam a média móvel dos primeiros dias
+        first = today - window - SHORT_WINDOW_DAYS + 2
+        series = np.zeros(window + SHORT_WINDOW_DAYS - 1, np.int64)
+        for part in (since_day(closed, first), recent):
+            mask = part.items == item.id
+            np.add.at(series, part.days[mask] - first, part.consumed[mask])
+        sums = np.cumsum(np.concatenate(([0], series)))
+        moving = (sums[SHORT_WINDOW_DAYS:] - sums[:-SHORT_WINDOW_DAYS]) / SHORT_WINDOW_DAYS
+        daily = series[SHORT_WINDOW_DAYS - 1:]
+
+        found = np.flatnonzero(first_day[0] == item.id)
+        age = today - int(first_day[1][found[0]]) + 1 if len(found) else window
+        avg = daily.sum() / int(self._divisors(age, window))
+        left = item.quantity / avg if avg > 0 else None
+        return {
+            "id": item.id,
+            "name": item.name,
+            "quantity": item.quantity,
+            "window_days": window,
+            "avg_daily": round(float(avg), 3),
+            "days_until_stockout": None if left is None else round(left, 1),
+            "stockout_date": None if left is None else from_epoch_day(today + int(left)),
+            "days": [
+                {"day": from_epoch_day(today - window + 1 + i), "consumed": int(c), "moving_avg": round(float(m), 3)}
+                for i, (c, m) in enumerate(zip(daily, moving))
+            ],
+        }
+
+    def stats(self) -> dict:
+        closed = self._closed
+        return {
+            "closed_through": self._closed_through.isoformat() if self._closed_through else None,
+            "rows": 0 if closed is None else len(closed.days),
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+        }
+
+
+consumption_analytics = ConsumptionAnalytics(settings.ANALYTICS_HISTORY_DAYS)
@@ -0,0 +1,179 @@
+"""
+Feed de alterações do estoque (GET /stock/events, Server-Sent Events).
+
+Cada commit que altera o estoque publica um evento com as mudanças compactas
+({"item_id", "name", "quantity", "change": created|updated|deleted}). Os eventos
+ficam num buffer circular para que um cliente que reconecte com Last-Event-ID
+receba o que perdeu; se o id já saiu do buffer (ou é de outro processo), o
+cliente recebe um evento "reset" e recarrega a listagem.
+
+A publicação vem das threads das rotas síncronas e do event loop; cada assinante
+é uma asyncio.Queue entregue pelo loop dono (call_soon_threadsafe).
+
+Com vários workers, as mudanças confirmadas num worker são repassadas aos outros
+(coordination.Peers) e publicadas também lá. Cada worker numera os próprios eventos:
+um cliente que reconecte em outro worker recebe "reset".
+"""
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+
+from config import settings
+from coordination import PEER_MAX_DATAGRAM, Peers, coordinator
+
+logger = logging.getLogger(__name__)
+
+CHANGE_BY_KIND = {"criacao": "created", "exclusao": "deleted"}
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Chamado no loop do assinante; um cliente lento demais recebe "reset" e é desligado
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.close()
+
+    def close(self):
+        """Descarta o que está pendente e sinaliza o fim do stream (None)."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class StockFeed:
+    def __init__(self, replay_size: int, max_pending: int, peers: Peers | None = None):
+        self.peers = peers
+        self.epoch = uuid.uuid4().hex[:12]
+        self.max_pending = max_pending
+        self._buffer: deque[tuple[int, str]] = deque(maxlen=replay_size)
+        self._subscribers: set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.published = 0
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}:{seq}"
+
+    def publish(self, changes: list[dict]):
+        """Publica mudanças confirmadas neste processo, aqui e nos outros workers."""
+        if not changes:
+            return
+        data = json.dumps(changes, ensure_ascii=False, separators=(",", ":"))
+        self._deliver(data)
+        if self.peers is not None and self.peers.active:
+            for batch in peer_batches(changes):
+                try:
+                    self.peers.broadcast({"type": "stock", "changes": batch})
+                except Exception:
+                    # Chamado no after_commit: uma falha no repasse não pode afetar a requisição
+                    logger.exception("Falha ao repassar mudanças do estoque aos outros workers")
+
+    def receive(self, message: dict):
+        """Mensagem de outro worker (ver coordination.Peers)."""
+        if message.get("type") == "stock" and message.get("changes"):
+            self._deliver(json.dumps(message["changes"], ensure_ascii=False, separators=(",", ":")))
+
+    def _deliver(self, data: str):
+        with self._lock:
+            self._seq += 1
+            event = (self._seq, data)
+            self._buffer.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Loop já encerrado
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id: str | None = None) -> tuple[Subscription, list[tuple[int, str]] | None, int]:
+        """
+        Registra um assinante. Devolve (assinatura, eventos posteriores a `last_event_id`, seq atual);
+        os eventos são None se não for possível retomar a partir do id (o cliente deve recarregar).
+        """
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+            current = self._seq
+            if not last_event_id:
+                return subscription, [], current
+            epoch, _, seq = last_event_id.partition(":")
+            if epoch != self.epoch or not seq.isdigit() or int(seq) > current:
+                return subscription, None, current
+            seq = int(seq)
+            if seq < current and (not self._buffer or seq < self._buffer[0][0] - 1):
+                return subscription, None, current
+            return subscription, [event for event in self._buffer if event[0] > seq], current
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def close(self):
+        """Encerra todos os streams abertos (desligamento da aplicação)."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.close)
+            except RuntimeError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "last_event_id": self.event_id(self._seq),
+                "buffered": len(self._buffer),
+            }
+
+
+def peer_batches(changes: list[dict]) -> list[list[dict]]:
+    """Divide as mudanças em lotes que cabem num datagrama (com folga para o envelope)."""
+    limit = PEER_MAX_DATAGRAM - 1024
+    batches, batch, size = [], [], 0
+    for change in changes:
+        change_size = len(json.dumps(change, ensure_ascii=False).encode()) + 1
+        if batch and size + change_size > limit:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(change)
+        size += change_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def changes_from_ledger(rows: list[dict]) -> list[dict]:
+    """Converte linhas do razão (record_stock_movements) nas mudanças publicadas no feed."""
+    return [
+        {
+            "item_id": row["item_id"],
+            "name": row["item_name"],
+            "quantity": row["balance"],
+            "change": CHANGE_BY_KIND.get(row["kind"], "updated"),
+            "username": row.get("username"),
+        }
+        for row in rows
+    ]
+
+
+stock_feed = StockFeed(
+    replay_size=settings.STOCK_FEED_REPLAY_SIZE,
+    max_pending=settings.STOCK_FEED_MAX_PENDING,
+    peers=coordinator.peers,
+)
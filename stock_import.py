@@ -0,0 +1,75 @@
+"""
+Leitura e validação da planilha de atualização de estoque (POST /stock/import/excel).
+
+Usado tanto pela rota síncrona quanto pela tarefa em segundo plano (jobs.py): a planilha
+vira a lista de linhas inválidas (já no formato do relatório) e a lista de tuplas
+(linha, item_id, quantidade) que crud.bulk_set_stock_quantities aplica. Com IDs repetidos,
+só a última linha de cada ID é aplicada; as anteriores saem como 'superseded'.
+"""
+REQUIRED_COLUMNS = ["ID do Item", "Quantidade"]
+
+
+class SpreadsheetError(ValueError):
+    """Planilha que não pode ser importada (ex.: colunas obrigatórias ausentes)."""
+
+
+def read_stock_spreadsheet(source) -> tuple[list[dict], list[tuple[int, int, int]]]:
+    """
+    Lê a planilha (caminho ou arquivo aberto) e separa as linhas inválidas das válidas.
+    Devolve (relatório das linhas inválidas, tuplas (linha, item_id, quantidade)).
+    """
+    # Importado só aqui: o pandas (e o numpy) pesa na partida e só a importação o usa
+    import pandas as pd
+
+    df = pd.read_excel(source)
+
+    # Verifica se as colunas necessárias existem
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        raise SpreadsheetError(f"A planilha deve conter as colunas: {', '.join(REQUIRED_COLUMNS)}")
+
+    # Validação vetorizada: valores vazios ou não numéricos viram NaN
+    ids = pd.to_numeric(df["ID do Item"], errors="coerce")
+    quantities = pd.to_numeric(df["Quantidade"], errors="coerce")
+    valid_ids = ids.notna() & (ids % 1 == 0)
+    valid_quantities = quantities.notna() & (quantities % 1 == 0) & (quantities >= 0)
+    valid = valid_ids & valid_quantities
+    lines = df.index + 2  # A linha 1 da planilha é o cabeçalho
+
+    invalid = [
+        {
+            "row": int(line),
+            "item_id": int(item_id) if id_ok else None,
+            "status": "invalid",
+            "detail": "Quantidade ausente ou inválida." if id_ok else "ID do Item ausente ou inválido.",
+        }
+        for line, item_id, id_ok in zip(lines[~valid], ids[~valid], valid_ids[~valid])
+    ]
+    rows = list(zip(lines[valid].tolist(), ids[valid].astype(int).tolist(), quantities[valid].astype(int).tolist()))
+    return invalid, rows
+
+
+def supersede_repeated_ids(rows: list[tuple[int, int, int]]) -> tuple[list[dict], list[tuple[int, int, int]]]:
+    """
+    Quando o mesmo ID aparece em várias linhas, prevalece a última. Devolve (relatório das
+    linhas substituídas, com status 'superseded', tuplas que de fato serão aplicadas).
+    """
+    last = {item_id: line for line, item_id, _ in rows}
+    superseded = [
+        {"row": line, "item_id": item_id, "status": "superseded", "detail": f"Substituída pela linha {last[item_id]}."}
+        for line, item_id, _ in rows if last[item_id] != line
+    ]
+    if not superseded:
+        return [], rows
+    return superseded, [row for row in rows if last[row[1]] == row[0]]
+
+
+def import_log_action(updated_count: int, not_found_ids: list[str], invalid_count: int, superseded_count: int = 0) -> str:
+    """Texto do log de atividade (e da mensagem devolvida) de uma importação."""
+    log_action = f"Atualizou o estoque via planilha. {updated_count} itens atualizados."
+    if not_found_ids:
+        log_action += f" IDs não encontrados: {', '.join(not_found_ids)}."
+    if invalid_count:
+        log_action += f" {invalid_count} linhas inválidas ignoradas."
+    if superseded_count:
+        log_action += f" {superseded_count} linhas com ID repetido substituídas pela última ocorrência."
+    return log_action
@@ -0,0 +1,135 @@
+"""
+Busca de itens de estoque por nome.
+
+- PostgreSQL: índice GIN com pg_trgm sobre f_unaccent(lower(name)), que atende
+  buscas por trecho ('%termo%') sem varredura sequencial; o resultado é ordenado
+  por prefixo e por similaridade de trigramas.
+- SQLite: tabela virtual FTS5 sincronizada por triggers, com remoção de acentos
+  e busca por prefixo de palavra, ordenada por bm25.
+- Qualquer outro caso (ou se a instalação falhar): ILIKE simples.
+"""
+import hashlib
+import logging
+import re
+
+from sqlalchemy import String, column, func, literal, literal_column, table, text
+from sqlalchemy.engine import Engine
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Mecanismo em uso: "trgm", "fts5" ou "like". Definido por setup_stock_search().
+backend = "like"
+
+_fts = table("stock_items_fts", column("rowid"))
+
+_POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() não é IMMUTABLE e por isso não pode ser usada num índice; o invólucro fixa o dicionário
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+    $$ SELECT public.unaccent('public.unaccent', $1) $$
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_stock_items_name_trgm ON stock_items USING gin (f_unaccent(lower(name)) gin_trgm_ops)",
+]
+
+_SQLITE_SETUP = [
+    """
+    CREATE VIRTUAL TABLE stock_items_fts USING fts5(
+        name, content='stock_items', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_items_fts_ai AFTER INSERT ON stock_items BEGIN
+        INSERT INTO stock_items_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_items_fts_ad AFTER DELETE ON stock_items BEGIN
+        INSERT INTO stock_items_fts(stock_items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_items_fts_au AFTER UPDATE OF name ON stock_items BEGIN
+        INSERT INTO stock_items_fts(stock_items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO stock_items_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    # Indexa os itens que já existiam antes da criação da tabela virtual
+    "INSERT INTO stock_items_fts(stock_items_fts) VALUES ('rebuild')",
+]
+
+
+def setup_stock_search(engine: Engine):
+    """Cria (se necessário) as estruturas de busca do banco em uso e escolhe o mecanismo."""
+    global backend
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == "postgresql":
+                for statement in _POSTGRES_SETUP:
+                    conn.execute(text(statement))
+                backend = "trgm"
+            elif dialect == "sqlite":
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_items_fts'")
+                ).first()
+                if not exists:
+                    for statement in _SQLITE_SETUP:
+                        conn.execute(text(statement))
+                backend = "fts5"
+    except Exception as e:
+        logger.warning("Busca indexada indisponível (%s), usando ILIKE: %s", dialect, e)
+        backend = "like"
+
+
+def setup_fingerprint() -> str:
+    """Identifica as instruções de instalação; muda quando elas mudam (ver startup.ensure_schema)."""
+    return hashlib.sha256("\n".join(_POSTGRES_SETUP + _SQLITE_SETUP).encode()).hexdigest()
+
+
+def use_backend(name: str):
+    """Escolhe o mecanismo já instalado numa partida anterior, sem repetir a instalação."""
+    global backend
+    backend = name
+
+
+def _fts_query(term: str) -> str:
+    """Converte o termo digitado numa consulta FTS5: todas as palavras, cada uma como prefixo."""
+    return " ".join(f'"{token}"*' for token in re.findall(r"\w+", term))
+
+
+def filter_stock_items(query, search: str):
+    """
+    Aplica o filtro e a ordenação por relevância do termo `search` a uma consulta
+    sobre StockItem (Query ou Select). Sem termo, a consulta é devolvida intacta.
+    """
+    search = search.strip()
+    if not search:
+        return query
+
+    name = models.StockItem.name
+
+    if backend == "trgm":
+        normalized_name = func.f_unaccent(func.lower(name), type_=String)
+        normalized_term = func.f_unaccent(func.lower(literal(search)), type_=String)
+        return query.where(
+            normalized_name.like("%" + normalized_term + "%")
+        ).order_by(
+            normalized_name.like(normalized_term + "%").desc(),
+            func.similarity(normalized_name, normalized_term).desc(),
+            name,
+        )
+
+    if backend == "fts5":
+        fts_query = _fts_query(search)
+        if fts_query:
+            return query.join(_fts, _fts.c.rowid == models.StockItem.id).where(
+                literal_column("stock_items_fts").op("MATCH")(fts_query)
+            ).order_by(func.bm25(literal_column("stock_items_fts")), name)
+
+    return query.where(name.ilike(f"%{search}%"))
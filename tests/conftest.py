@@ -0,0 +1,23 @@
+"""
+Configuração dos testes: um banco SQLite descartável por execução, definido antes de a
+aplicação (config.settings) ser importada.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Os templates e a pasta static são abertos por caminho relativo
+os.chdir(ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="estoque-tests-")
+os.environ.update({
+    "SECRET_KEY": "testes",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_workdir, 'estoque.db')}",
+    "COORDINATION_DIR": os.path.join(_workdir, "coordination"),
+    "ADMIN_DEFAULT_USERNAME": "admin",
+    "ADMIN_DEFAULT_PASSWORD": "senha-admin",
+    "JOB_DIR": os.path.join(_workdir, "job_files"),
+    "LOG_ARCHIVE_DIR": os.path.join(_workdir, "log_archive"),
+})
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+import crud, models
+import startup
+from app import app
+from database import SessionLocal, engine
+from stock_analytics import ConsumptionAnalytics
+
+
+def _seed_pre_ledger_history():
+    """Itens e logs como ficavam antes do razão: as movimentações só existem no texto dos logs."""
+    three_days_ago = datetime.now(timezone.utc) - timedelta(days=3)
+    db = SessionLocal()
+    try:
+        if not crud.get_user_by_username(db, "planejador"):
+            db.add(models.User(username="planejador", role="user"))
+        parafuso = models.StockItem(name="Parafuso 'M6'", quantity=8, created_by_username="planejador")
+        db.add(parafuso)
+        db.flush()
+        db.add_all([
+            models.LogEntry(username="planejador", timestamp=three_days_ago,
+                            action="Criou o item de inventário 'Parafuso 'M6''"),
+            models.LogEntry(username="planejador", timestamp=three_days_ago + timedelta(minutes=1),
+                            action="Deu entrada de 20 unidades no item 'Parafuso 'M6'' (Estoque atual: 20)"),
+            models.LogEntry(username="planejador", timestamp=three_days_ago + timedelta(hours=1),
+                            action="Deu saida de 12 unidades no item 'Parafuso 'M6'' (Estoque atual: 8)"),
+            # Item excluído e depois recriado com o mesmo nome: a saída antiga não é dele
+            models.LogEntry(username="planejador", timestamp=three_days_ago,
+                            action="Deu saida de 5 unidades no item 'Porca' (Estoque atual: 0)"),
+            models.LogEntry(username="planejador", timestamp=three_days_ago + timedelta(minutes=5),
+                            action="Excluiu o item de inventário 'Porca'"),
+        ])
+        db.add(models.StockItem(name="Porca", quantity=0, created_by_username="planejador"))
+        db.commit()
+        return parafuso.id
+    finally:
+        db.close()
+
+
+def test_pre_ledger_logs_show_up_in_the_analytics():
+    # Partida em banco novo: cria o esquema (o razão ainda está vazio)
+    with TestClient(app):
+        pass
+    item_id = _seed_pre_ledger_history()
+    db = SessionLocal()
+    try:
+        db.query(models.StockLedgerEntry).delete()
+        db.commit()
+    finally:
+        db.close()
+
+    startup.backfill_stock_ledger(engine)
+    db = SessionLocal()
+    try:
+        assert crud.backfill_stock_ledger(db) == 0  # Não duplica ao rodar de novo
+        kinds = db.execute(
+            select(models.StockLedgerEntry.item_name, models.StockLedgerEntry.kind, func.sum(models.StockLedgerEntry.delta))
+            .group_by(models.StockLedgerEntry.item_name, models.StockLedgerEntry.kind)
+            .order_by(models.StockLedgerEntry.item_name, models.StockLedgerEntry.kind)
+        ).all()
+    finally:
+        db.close()
+    assert kinds == [("Parafuso 'M6'", "criacao", 0), ("Parafuso 'M6'", "entrada", 20), ("Parafuso 'M6'", "saida", -12)]
+
+    # Instância nova: a do módulo pode já ter carregado o histórico numa partida anterior
+    analytics = ConsumptionAnalytics(history_days=365)
+    db = SessionLocal()
+    try:
+        report = analytics.report(db, window=30)
+        history = analytics.item_history(db, db.get(models.StockItem, item_id), window=30)
+    finally:
+        db.close()
+    items = {item["name"]: item for item in report["items"]}
+    assert items["Parafuso 'M6'"]["consumed"] == 12
+    # Dividido pelos dias desde a primeira movimentação (4, contando hoje), não pela janela de 30
+    assert items["Parafuso 'M6'"]["avg_daily"] == 3.0
+    assert items.get("Porca", {"consumed": 0})["consumed"] == 0
+    assert sum(day["consumed"] for day in history["days"]) == 12
@@ -0,0 +1,47 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from login_guard import LoginRateLimited, LoginRateLimiter
+
+
+def test_rate_limiter_stays_bounded_with_distinct_usernames():
+    limiter = LoginRateLimiter(limit=10, window=60, max_users=1000)
+    for i in range(30000):
+        limiter.check(f"usuario-{i}")
+    assert len(limiter) == 1000
+    assert limiter.evictions == 29000
+
+
+def test_rate_limiter_drops_users_outside_the_window():
+    limiter = LoginRateLimiter(limit=10, window=0.05)
+    for i in range(500):
+        limiter.check(f"usuario-{i}")
+    time.sleep(0.06)
+    limiter.check("outro")
+    assert len(limiter) == 1
+    assert limiter.evictions == 0
+
+
+def test_rate_limiter_still_limits_the_attacked_user():
+    limiter = LoginRateLimiter(limit=3, window=60, max_users=100)
+    for i in range(3):
+        limiter.check("admin")
+        for j in range(50):
+            limiter.check(f"spray-{i}-{j}")
+    try:
+        limiter.check("admin")
+    except LoginRateLimited:
+        pass
+    else:
+        raise AssertionError("a quarta tentativa deveria ser recusada")
+
+
+def test_login_after_restarting_the_app():
+    from app import app
+
+    form = {"username": "admin", "password": "senha-admin"}
+    for _ in range(2):
+        with TestClient(app) as client:
+            response = client.post("/token", data=form)
+            assert response.status_code == 200, response.text
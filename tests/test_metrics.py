@@ -0,0 +1,25 @@
+from fastapi.testclient import TestClient
+
+import crud
+from app import app
+from config import settings
+
+
+def _bearer(username: str, role: str) -> dict:
+    return {"Authorization": f"Bearer {crud.create_access_token({'sub': username, 'role': role})}"}
+
+
+def test_metrics_require_the_metrics_token_or_an_admin(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "coletor")
+    with TestClient(app) as client:
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer errado"}).status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer coletor"}).status_code == 200
+        assert client.get("/metrics", headers=_bearer("admin", "admin")).status_code == 200
+
+
+def test_anonymous_metrics_are_opt_in(monkeypatch):
+    with TestClient(app) as client:
+        assert client.get("/metrics").status_code == 401
+        monkeypatch.setattr(settings, "METRICS_PUBLIC", True)
+        assert client.get("/metrics").status_code == 200